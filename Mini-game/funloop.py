@@ -1,26 +1,49 @@
 import pygame
 import time
 from pygame import gfxdraw
-from collections import deque
 import sys
+import os
 import random
 import math
 import numpy as np
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from engine import integrators
+from engine import cache
+from engine import assets
+from engine.spatial import VECTOR_PAIRS, SpatialHash, StaticGrid, rects_collide
+from engine.render import DirtyRenderer
+from engine.layers import StaticLayer
+from engine.profiler import Profiler
+from engine import replay
+from engine.entities import EntityStore, Handle, Handles
+from engine.loop import FixedStep, interpolate, present
+from engine.pipeline import Pipeline
+from gravity import GravityField
+from trails import Trail, TrailPool
+import level
+import scores
 
 windowHeight = 720
 windowWidth = 1080
+#Game name in the header of funloop's replay files
+REPLAY_NAME = "funloop"
+
+#Kind tags in the entity store
+ASTEROID = 1
+ROCKET = 2
+BLOCK = 3
+SUN = 4
+BLACK_HOLE = 5
+
+class Asteroid(Handle):
+	__slots__ = ("game", "image")
+	#Integrator name for this class of body, None uses the game's
+	integrator = None
 
-class Asteroid:
 	def __init__(self, game, x, y, dx, dy, id, image=None, radius=5):
+		Handle.__init__(self, game.entities, id)
+		game.entities.add(id, ASTEROID, x, y, dx, dy, radius, math.sqrt(radius), 100)
 		self.game = game
-		self.x = x
-		self.y = y
-		self.dx = dx
-		self.dy = dy
-		self.radius = radius
-		self.mass = math.sqrt(radius)
-		self.id = id
-		self.g = 100
 		self.image = image
 
 	def rect(self):
@@ -28,19 +51,7 @@ class Asteroid:
 
 	def move(self):
 		if self.game.first_shot:
-			delta_args = self.runge_katta()
-			if abs(delta_args[0]) > 0.08:
-				self.x = self.x + delta_args[0]
-			if abs(delta_args[1]) > 0.08:
-				self.y = self.y + delta_args[1]
-			self.dx = self.dx + delta_args[2]
-			self.dy = self.dy + delta_args[3]
-
-	def draw(self):
-		size = self.radius * 2.0 / 1087
-		asteroid = pygame.transform.rotozoom(self.image, 0, size)
-		self.game.window.blit(asteroid, (self.x - self.radius, self.y - self.radius))
-		# pygame.gfxdraw.aacircle(window, int(self.x), int(self.y), self.size, self.color)
+			self.game.integrate([self])
 
 	def grow(self, size, mass, x, y, dx, dy):
 		if not self.radius > (size * 2):
@@ -70,132 +81,49 @@ class Asteroid:
 		self.dx = momentum_x / (mass + self.mass)
 		self.dy = momentum_y / (mass + self.mass)
 
-	def runge_katta(self):
-		#calculate accel at start
-		k_1_accel = self.calc_accel(self.x, self.y)
-		k_1_vel = (self.dx, self.dy)
-
-
-		#calculate accel in the middle (k2)
-		mid_coordinates = (self.x + 0.5*k_1_vel[0], self.y + 0.5*k_1_vel[1])
-		k_2_accel = self.calc_accel(mid_coordinates[0], mid_coordinates[1])
-		k_2_vel = (self.dx + 0.5*k_1_accel[0], self.dy + 0.5*k_1_accel[1])
-
-		#calculate accel in the middle (k3)
-		mid_coordinates_k3 = (self.x + 0.5*k_2_vel[0], self.y + 0.5*k_2_vel[1])
-		k_3_accel = self.calc_accel(mid_coordinates_k3[0], mid_coordinates_k3[1])
-		k_3_vel = (self.dx + 0.5*k_2_accel[0], self.dy + 0.5*k_2_accel[1])
-
-		#calculate accel in the middle
-		end_coordinates = (self.x + k_3_vel[0], self.y + k_3_vel[1])
-		k_4_accel = self.calc_accel(end_coordinates[0], end_coordinates[1])
-		k_4_vel = (self.dx + k_3_accel[0], self.dy + k_3_accel[1])
-
-		delta_x = (1.0/6.0) * (k_1_vel[0] + 2.0 * (k_2_vel[0] + k_3_vel[0]) + k_4_vel[0])
-		delta_y = (1.0/6.0) * (k_1_vel[1] + 2.0 * (k_2_vel[1] + k_3_vel[1]) + k_4_vel[1])
-		delta_vx = (1.0/6.0) * (k_1_accel[0] + 2.0 * (k_2_accel[0] + k_3_accel[0]) + k_4_accel[0])
-		delta_vy = (1.0/6.0) * (k_1_accel[1] + 2.0 * (k_2_accel[1] + k_3_accel[1]) + k_4_accel[1])
-
-		#calculate accel 
-		return (delta_x, delta_y, delta_vx, delta_vy)
-
-	def calc_force(self, arr, x, y, sun_range=-1):
-		force_magnitude_hor = 0
-		force_magnitude_vert = 0
-		for index in arr:
-			each = arr[index]
-			squared_distance = (each.x - x) ** 2 + (each.y - y) ** 2 
-			if (sun_range >= 0 and math.sqrt(squared_distance) > sun_range):
-				continue
-			if each.id == self.id:
-				continue
-			distance = math.sqrt(squared_distance)
-			force = (self.g * each.mass)/ (squared_distance ** 1.2)
-
-			if abs(each.x - x) <= 0.01:
-				force_y = force
-				force_x = 0
-			else:
-				disp_y = each.y - y
-				disp_x = each.x - x
-				theta = math.atan(disp_y/disp_x)
-				if disp_x >= 0:
-					force_magnitude_hor += force*math.cos(theta)
-				else:
-					force_magnitude_hor -= force*math.cos(theta)
-
-				if disp_y >= 0:
-					force_magnitude_vert += force*abs(math.sin(theta))
-				else:
-					force_magnitude_vert -= force*abs(math.sin(theta))
+	def calc_accel(self, x, y):
+		accel_x, accel_y = self.game.gravity.accel(x, y, self.id, self.g / self.mass, self.kind == ROCKET)
+		return accel_x[0], accel_y[0]
 
-		return [force_magnitude_hor, force_magnitude_vert]
+class Block(Handle):
+	__slots__ = ("game", "image", "color")
 
-	def calc_accel(self, x, y):
-		sun_range = 300
-		forces = self.calc_force(self.game.asteroids, x, y, 80)
-		forces_rocket = self.calc_force(self.game.rockets, x, y)
-		if self.id in self.game.rockets:
-			sun_range = -1
-		sun_arr = {0:self.game.sun}
-		forces_sun = self.calc_force(sun_arr, x, y, sun_range)
-		forces_black_holes = self.calc_force(self.game.black_holes, x, y, sun_range)
-		forces_x = forces[0] + forces_rocket[0] + forces_sun[0] + forces_black_holes[0]
-		forces_y = forces[1] + forces_rocket[1] + forces_sun[1] + forces_black_holes[1]
-		accel_x = forces_x / self.mass
-		accel_y = forces_y / self.mass
-		return accel_x, accel_y
-
-class Block():
-	def __init__(self, game, x, y, image, id, size=40):
-		self.x, self.y = x, y
+	#Blocks are stored in bulk by Game.add_blocks, this wraps a stored one
+	#when Game.blocks is looked up
+	def __init__(self, game, id, image):
+		Handle.__init__(self, game.entities, id)
 		self.game = game
-		self.size = size
-		self.id = id
 		self.color = [200, 200, 200]
 		self.image = image
 
-	def draw(self):
-		block = pygame.transform.scale(self.image, (self.size, self.size))
-		self.game.window.blit(block, (self.x, self.y))
+	@property
+	def size(self):
+		return int(self.radius)
 
 	def rect(self):
 		return (self.x, self.y, self.size - 5, self.size - 5)
 class Rocket(Asteroid):
+	__slots__ = ("color", "trail")
+
 	def __init__(self, game, dx, dy, id, radius=3):
-		self.x, self.y = 20, windowHeight // 2
-		super(self.__class__, self).__init__(game, self.x, self.y, dx, dy, id, radius)
-		self.game = game
+		super(self.__class__, self).__init__(game, 20, windowHeight // 2, dx, dy, id, radius)
+		self.kind = ROCKET
 		self.radius = radius
-		self.dx = dx
-		self.dy = dy
-		self.id = id
 		self.mass *= 30
 		self.g *= 2
 		self.color = [200, 200, 200]
-		self.positions = []
-
-	def draw(self):
-		self.positions.append([self.x, self.y, 255])
-
-		for each in self.positions:
-			color = self.color + [each[2]]
-			pygame.gfxdraw.aacircle(self.game.window, int(each[0]), int(each[1]), self.radius, color)
-			pygame.gfxdraw.filled_circle(self.game.window, int(each[0]), int(each[1]), self.radius, color)
-			each[2] -= 4
-		if self.positions[0][2] <= 0:
-			del self.positions[0]
+		self.trail = Trail()
 
 	def rect(self):
 		return (self.x - self.radius, self.y - self.radius, self.radius * 2 + 4, self.radius * 2 + 4)
 
 class Sun(Asteroid):
+	__slots__ = ("center_radius",)
+
 	def __init__(self, game, id, x, y, radius=15):
-		self.x, self.y = x, y
-		super(self.__class__, self).__init__(game, self.x, self.y, 0, 0, id, radius)
-		self.game = game
+		super(self.__class__, self).__init__(game, x, y, 0, 0, id, radius)
+		self.kind = SUN
 		self.radius = radius
-		self.id = id
 		self.mass *= 10
 		self.g *= 100
 		self.image = self.game.sun_image
@@ -204,68 +132,138 @@ class Sun(Asteroid):
 	def move(self):
 		return
 
-	def draw(self):
-		self.game.window.blit(self.image, (self.x - self.radius, self.y - self.radius))
-		# pygame.gfxdraw.filled_circle(self.game.window, self.x, self.y, int(self.center_radius), (255, 255, 220))
-
 
 	def merge(self, asteroid):
 		self.mass += asteroid.mass
+		self.game.gravity.invalidate_static()
 		self.game.score += int(asteroid.mass * 10)
 		self.center_radius = math.sqrt(max((self.mass - (7 * math.sqrt(self.radius))), 0))
 
 	def black_merge(self, asteroid):
 		self.mass += asteroid.mass
+		self.game.gravity.invalidate_static()
 		self.game.score += int(asteroid.mass * 2)
 		self.center_radius = math.sqrt(max((self.mass - (7 * math.sqrt(self.radius))), 0))
 
 
 
+class Snapshot:
+	"""Everything a frame draws, copied out of the game by Game.capture() so
+	it can be drawn while the game moves on"""
+	def __init__(self):
+		self.frame = 0
+		self.score = 0
+		self.finished = False
+		#How far drawing is between the state before the last step and this one
+		self.alpha = 1.0
+		#Asteroids, and (ids, x, y) of every entity before the last step
+		self.ids = np.zeros(0, dtype=np.int64)
+		self.x = self.y = self.radius = np.zeros(0)
+		self.previous = None
+		#Copies of the live rockets' trails and the kept ones, with the fade clock
+		self.rockets = []
+		self.trails = []
+		self.trail_frame = 0
+		#None when nothing static changed since the last snapshot, otherwise
+		#(suns, blocks, regions): (image, x, y) of the sun and black holes,
+		#(x, y, size) of every block and the rects that changed, None for all
+		self.statics = None
+		self.counts = {}
+
 class Game:
-	def __init__(self, window):
+	#gravity_mode is "exact" or "barnes_hut", theta is the Barnes-Hut opening angle.
+	#dirty redraws only the regions sprites moved through instead of the whole screen.
+	#integrator is a name from integrators.INTEGRATORS or an integrator, bodies
+	#whose class sets its own integrator use that one instead.
+	#static_field reads the sun and black holes' pull from a precomputed lattice,
+	#which pays off on levels with many black holes. profile starts the frame
+	#profiler, F3 toggles its overlay and F4 exports it to profile.csv, which
+	#needs profile or the overlay on to have recorded anything.
+	#seed makes the level reproducible, a random one is picked when None.
+	#threaded has run() step the game on a worker thread while it draws
+	def __init__(self, window=None, gravity_mode="exact", theta=0.5, dirty=False, integrator="rk4", static_field=False, profile=False, seed=None, threaded=False):
 		self.window = window
+		self.threaded = threaded
+		self.profiler = Profiler(profile)
+		if seed is None:
+			seed = random.SystemRandom().randrange(1 << 32)
+		self.seed = seed
+		self.random = random.Random(seed)
+		#Set to a replay.Recorder to record every shot
+		self.recorder = None
+		#Physics steps per second, and frames drawn per second by run()
 		self.FPS = 200
-		self.font = pygame.font.SysFont("Courier", 64, True)
+		self.render_FPS = 60
+		#Headless games (window=None) run the physics only, with no images, fonts or clock
+		self.headless = window is None
+		self.frame = 0
+		if not self.headless:
+			self.font = cache.font("Courier", 64, True)
 		self.b_game_over = False
+		#State of every body, the dicts below map ids to handles into it
+		self.entities = EntityStore()
+		#(ids, x, y) of every entity before the last step, for drawing between
+		#steps. Only kept when there is a window
+		self.previous = None
 		self.asteroids = {}
 		self.rockets = {}
-		self.blocks = {}
+		self.blocks = Handles(lambda id: Block(self, id, self.block_image))
 		self.black_holes = {}
-		self.bg_image = pygame.image.load("background.png").convert()
-		self.asteroid_image = pygame.image.load("asteroid.png").convert_alpha()
-		self.sun_image = pygame.image.load("sun2.png").convert_alpha()
-		self.Earth = pygame.image.load("Earth.png").convert_alpha()
-		self.black_hole_image = pygame.image.load("black_hole.png").convert_alpha()
-		self.block_image = pygame.image.load("dust_cloud.png").convert_alpha()
-		self.Earth = pygame.transform.rotozoom(self.Earth, 0, 0.01666666666)
-		self.bg = pygame.transform.rotozoom(self.bg_image, 0, 0.5)
-
+		self.gravity = GravityField(gravity_mode, theta, bounds=(windowWidth, windowHeight) if static_field else None)
+		self.grid = SpatialHash(64)
+		#Blocks never move, so they stay in their own grid from frame to frame
+		self.block_grid = StaticGrid(self.grid.cell_size)
+		self.integrator = integrators.get(integrator)
+		self.integrators = {}
+		if self.headless:
+			self.asteroid_image = self.sun_image = self.black_hole_image = self.block_image = None
+		else:
+			self.load_images()
+		self.renderer = None
+		if dirty and not self.headless:
+			self.renderer = DirtyRenderer(window, None)
+		#Rects where the background, planets or blocks changed since the last
+		#capture, None when all of them need to be redrawn
+		self.static_changes = None
+		self.static_layer = None
+		#Sun and black holes, and blocks, as last drawn
+		self.drawn_suns = []
+		self.drawn_blocks = []
+
+		self.level_file = "input.txt"
 		self.counter = 0
-		self.last_shot = 0
 		self.delay = 800
+		#The first shot of a round can be fired straight away
+		self.last_shot = -self.delay
 		self.sun_x = 0
 		self.sun_y = 0
 
 		# self.ammo = 5
-		self.asteroid_trail = []
 		self.rocket_radius = 3
+		self.trails = TrailPool(self.rocket_radius)
 		self.game_over_str = "Game Over"
 		self.first_shot = False
 		self.success = 1
 		self.score = 0
 		self.shots = 0
+		#(frame, rocket id, what it hit, id of that) for every rocket removed,
+		#what is "asteroid", "block", "sun", "black_hole", "rocket" or "edge"
+		self.hits = []
 		self.block_size = 40
 
-	def draw_trails(self):
-		trail_color = [200, 200, 200]
-		for positions in self.asteroid_trail:
-			for each in positions:
-				color = trail_color + [each[2]]
-				pygame.gfxdraw.aacircle(self.window, int(each[0]), int(each[1]), self.rocket_radius, color)
-				pygame.gfxdraw.filled_circle(self.window, int(each[0]), int(each[1]), self.rocket_radius, color)
-				each[2] -= 4
-			if len(positions) > 0 and positions[0][2] <= 0:
-				del positions[0]
+	#Images are shared by every game in the process, see engine.assets
+	def load_images(self):
+		self.asteroid_image = assets.image("asteroid.png")
+		self.sun_image = assets.image("sun2.png")
+		self.black_hole_image = assets.image("black_hole.png")
+		self.block_image = assets.image("dust_cloud.png")
+		self.Earth = assets.image("Earth.png", scale=0.01666666666)
+		self.bg = assets.image("background.png", alpha=False, scale=0.5)
+
+	#Milliseconds of game time, counted in frames so that recorded games and
+	#headless runs see the same firing delays as a live game
+	def get_ticks(self):
+		return self.frame * 1000 // self.FPS
 
 
 	# def spawn_asteroid(self):
@@ -288,11 +286,11 @@ class Game:
 	def generate_asteroids(self, num):
 		initial_pos = []
 		for i in range(num):
-			rand_x = random.randint(45, 150)
-			rand_y = random.randint(30, windowHeight - 30)
+			rand_x = self.random.randint(45, 150)
+			rand_y = self.random.randint(30, windowHeight - 30)
 			while rand_x >= windowWidth // 2 - 200 and rand_x <= windowWidth // 2 + 200 and rand_y >= windowHeight // 2 - 200 and rand_y <= windowHeight // 2 + 200:
-				rand_x = random.randint(30, windowWidth - 30)
-				rand_y = random.randint(30, windowHeight - 30)
+				rand_x = self.random.randint(30, windowWidth - 30)
+				rand_y = self.random.randint(30, windowHeight - 30)
 			initial_pos.append([rand_x, rand_y])
 		for i in range(len(initial_pos)):
 			asteroid = Asteroid(self, initial_pos[i][0], initial_pos[i][1], 0, 0, self.counter, self.asteroid_image, 8)
@@ -316,33 +314,101 @@ class Game:
 		pattern_1[3*blocks_height // 4, 3*blocks_width // 4] = 3
 
 		return pattern_1
+	#Cell grid of the level file, see level.open_level for the formats
 	def read_pattern(self):
-		blocks_width = windowWidth // self.block_size
-		blocks_height = windowHeight // self.block_size
-		file = open("input.txt")
-		lines = [line.rstrip("\n").split(',') for line in file.readlines()]
-		pattern = np.zeros((blocks_height, blocks_width))
-		for j in range(blocks_height):
-			for i in range(blocks_width):
-				pattern[j, i] = lines[j][i]
-		return pattern
+		return level.open_level(self.level_file, self.block_size).cells
 
+	#Creates the blocks, sun and black holes of a cell grid, numbered in
+	#row-major order like a walk over the grid would
 	def generate_blocks(self, pattern):
-		for j in range(len(pattern)):
-			for i in range(len(pattern[0])):
-				if pattern[j, i] == 1:
-					block = Block(self, i * self.block_size, j * self.block_size, self.block_image, self.counter, self.block_size)
-					self.blocks[self.counter] = block
-					self.counter += 1
-
-				elif pattern[j, i] == 2:
-					self.sun = Sun(self, self.counter, i * self.block_size, j * self.block_size)
-					self.counter += 1
-				elif pattern[j, i] == 3:
-					black_hole = Sun(self, self.counter, i * self.block_size, j * self.block_size)
-					self.counter += 1
-					self.black_holes[self.counter] = black_hole
-					black_hole.image = self.black_hole_image
+		pattern = np.asarray(pattern)
+		rows, columns = np.nonzero((pattern == level.BLOCK) | (pattern == level.SUN) | (pattern == level.BLACK_HOLE))
+		kinds = pattern[rows, columns]
+		ids = np.arange(self.counter, self.counter + len(kinds))
+		xs = columns * self.block_size
+		ys = rows * self.block_size
+		self.counter += len(kinds)
+
+		block = kinds == level.BLOCK
+		self.add_blocks(ids[block].tolist(), xs[block], ys[block], self.block_size)
+		#Only one sun is simulated, the last one in the level as it always has been
+		suns = ids[kinds == level.SUN]
+		for kind, id, x, y in zip(kinds[~block].tolist(), ids[~block].tolist(), xs[~block].tolist(), ys[~block].tolist()):
+			if kind == level.SUN and id == suns[-1]:
+				self.sun = Sun(self, id, x, y)
+			elif kind == level.BLACK_HOLE:
+				black_hole = Sun(self, id, x, y)
+				black_hole.image = self.black_hole_image
+				black_hole.kind = BLACK_HOLE
+				#Black holes have always been stored one past their id
+				self.black_holes[id + 1] = black_hole
+
+	#Stores blocks with ids at x, y in one call and adds them to the block
+	#grid. x, y and size are arrays or one value for every block
+	def add_blocks(self, ids, x, y, size):
+		#Blocks keep their side length in the radius column
+		slots = self.entities.add_many(ids, BLOCK, x, y, radius=size)
+		self.blocks.add_many(ids)
+		self.block_grid.insert_many([("block", id) for id in ids], self.rects()[slots])
+
+	#(ids, x, y, size) lists of every block, read from the store in one go
+	def block_rows(self):
+		store = self.entities
+		ids = list(self.blocks)
+		slots = store.slots(ids)
+		return ids, store.x[slots].tolist(), store.y[slots].tolist(), store.radius[slots].astype(int).tolist()
+
+	#Asteroids at the positions a level gives them
+	def place_asteroids(self, entities):
+		for x, y, size in zip(entities["x"].tolist(), entities["y"].tolist(), entities["size"].tolist()):
+			self.asteroids[self.counter] = Asteroid(self, x, y, 0, 0, self.counter, self.asteroid_image, int(size))
+			self.counter += 1
+
+	#Advances every body by one frame, together on state arrays for each integrator
+	def integrate(self, bodies):
+		groups = {}
+		for each in bodies:
+			groups.setdefault(integrators.for_body(each, self.integrator, self.integrators), []).append(each.id)
+		for integrator, ids in groups.items():
+			self.integrate_group(integrator, ids)
+
+	#Steps the bodies with ids in place in the entity store
+	def integrate_group(self, integrator, ids):
+		store = self.entities
+		slots = store.slots(ids)
+		x, y, dx, dy = store.x[slots], store.y[slots], store.dx[slots], store.dy[slots]
+		ids = store.ids[slots]
+		scale = store.g[slots] / store.mass[slots]
+		rocket = store.kind[slots] == ROCKET
+		accel = lambda x, y, active=slice(None): self.gravity.accel(x, y, ids[active], scale[active], rocket[active])
+		delta_x, delta_y, delta_vx, delta_vy = integrator(accel, x, y, dx, dy, ids.tolist())
+
+		#Tiny movements are ignored so resting asteroids do not drift
+		store.x[slots] = np.where(np.abs(delta_x) > 0.08, x + delta_x, x)
+		store.y[slots] = np.where(np.abs(delta_y) > 0.08, y + delta_y, y)
+		store.dx[slots] = dx + delta_vx
+		store.dy[slots] = dy + delta_vy
+
+	#rect() of every stored entity as [x, y, width, height], by slot, worked
+	#out in one pass over the store arrays
+	def rects(self):
+		store = self.entities
+		x, y, radius, kind = store.x[:store.count], store.y[:store.count], store.radius[:store.count], store.kind[:store.count]
+		block = kind == BLOCK
+		side = np.where(block, np.floor(radius) - 5, radius * 2 + np.where(kind == ROCKET, 4, -2))
+		left = np.where(block, x, x - radius)
+		top = np.where(block, y, y - radius)
+		return np.stack([left, top, side, side], axis=1)
+
+	#The (i, j) pairs of ids whose rects collide, in the order given
+	def colliding(self, rects, pairs):
+		slots = self.entities.slots([id for pair in pairs for id in pair]).reshape(-1, 2)
+		if len(pairs) < VECTOR_PAIRS:
+			rows = rects[slots].tolist()
+			return [pair for pair, (first, second) in zip(pairs, rows) if self.check_collisions(first, second) or self.check_collisions(second, first)]
+		first, second = rects[slots[:, 0]], rects[slots[:, 1]]
+		hit = rects_collide(first, second) | rects_collide(second, first)
+		return [pair for pair, each in zip(pairs, hit.tolist()) if each]
 
 	def check_collisions(self, rect1, rect2, already_collided = False): #rect: x, y, width, height
 		if (rect1[0] >= rect2[0] and rect1[0] <= rect2[0] + rect2[2]) or (rect1[0] <= rect2[0] and rect1[0] + rect1[2] >= rect2[0]):
@@ -351,175 +417,439 @@ class Game:
 					return True
 		return False
 
-	def run(self):
+	#For each body id, whether its rect collides with each static body, the
+	#sun and black holes given as slots
+	def touching_static(self, rects, ids, static):
+		bodies = self.entities.slots(ids)
+		if len(bodies) * len(static) < VECTOR_PAIRS:
+			static_rows = rects[static].tolist()
+			return [[self.check_collisions(row, other) or self.check_collisions(other, row) for other in static_rows] for row in rects[bodies].tolist()]
+		first, second = rects[bodies][:, None, :], rects[static][None, :, :]
+		return (rects_collide(first, second) | rects_collide(second, first)).tolist()
+
+	#Loads level_file, asteroids come from the level when it places any and
+	#are scattered at random otherwise
+	def setup(self, num_asteroids=7):
+		layout = level.open_level(self.level_file, self.block_size)
+		self.block_size = layout.cell_size
+		placed = layout.asteroids()
+		if len(placed) > 0:
+			self.place_asteroids(placed)
+		else:
+			self.generate_asteroids(num_asteroids)
+		self.generate_blocks(layout.cells)
+
+	#Launches a rocket from Earth towards mouse_pos
+	def fire(self, mouse_pos):
+		if self.recorder is not None:
+			self.recorder.click(self.frame, mouse_pos)
+		if not self.first_shot:
+			self.first_shot = True
+		self.last_shot = self.get_ticks()
+		magnitude = math.sqrt(mouse_pos[0] ** 2 + ((windowHeight // 2) - mouse_pos[1]) ** 2)
+		mouse_dx = mouse_pos[0] / magnitude * 3
+		mouse_dy = (mouse_pos[1] - (windowHeight // 2)) / magnitude * 3
+		self.rockets[self.counter] = Rocket(self, mouse_dx, mouse_dy, self.counter, self.rocket_radius)
+		self.counter += 1
+		self.shots += 1
+		# self.ammo -= 1
+
+	def finished(self):
+		return len(self.asteroids) <= 0 and len(self.blocks) <= 0
+
+	#Advances physics and collisions by one frame, draws nothing
+	def step(self):
+		if not self.headless:
+			count = self.entities.count
+			self.previous = (self.entities.ids[:count].copy(), self.entities.x[:count].copy(), self.entities.y[:count].copy())
+		self.physics()
+		self.profiler.lap("physics")
+		self.collisions()
+		self.profiler.lap("collisions")
+		if not self.headless:
+			self.trails.record(self.rockets.values())
+			self.profiler.lap("trails")
+		self.frame += 1
+
+	#One drawn frame of the game: job is (steps, click, alpha). Fires at the
+	#click position when the delay allows, runs the steps and captures the
+	#result into snapshot to be drawn alpha of a step on
+	def advance(self, job, snapshot):
+		steps, click, alpha = job
+		if click is not None and self.get_ticks() - self.last_shot >= self.delay:
+			self.fire(click)
+		for i in range(steps):
+			self.step()
+			if self.finished():
+				break
+		return self.capture(snapshot, alpha)
+
+	def physics(self):
+		self.gravity.load(self)
+		if self.first_shot:
+			groups = {}
+			for kind, bodies in ((Asteroid, self.asteroids), (Rocket, self.rockets)):
+				groups.setdefault(integrators.for_body(kind, self.integrator, self.integrators), []).extend(bodies)
+			for integrator, ids in groups.items():
+				if ids:
+					self.integrate_group(integrator, ids)
+
+	#Merges, explosions, scoring and removal of everything that collided
+	def collisions(self):
+		asteroids_to_merge = {}
+		object_removal = set()
+		store = self.entities
+		slot = store.slot
+		rects = self.rects()
+		static = store.slots([self.sun.id] + [each.id for each in self.black_holes.values()]).tolist()
+		black_hole_keys = list(self.black_holes)
+
+		#Broad phase, only objects sharing a grid cell are tested below
+		self.grid.clear()
+		entries = [(kind, i) for kind, objects in (("asteroid", self.asteroids), ("rocket", self.rockets)) for i in objects]
+		self.grid.insert_many(entries, rects[store.slots([i for kind, i in entries])])
+
+		x, y, radius, kind = store.x[:store.count], store.y[:store.count], store.radius[:store.count], store.kind[:store.count]
+		lost = (kind == ASTEROID) & ((x + radius <= -10) | (x - radius >= windowWidth + 10) | (y + radius <= -10) | (y - radius >= windowHeight + 10))
+		if lost.any():
+			self.success = 0
+			object_removal.update(i for i in self.asteroids if lost[slot[i]])
+
+		for i, j in self.colliding(rects, self.grid.pairs("asteroid", "asteroid")):
+			each, other = self.asteroids[i], self.asteroids[j]
+			if each in asteroids_to_merge:
+				asteroids_to_merge[each].append(other)
+			else:
+				asteroids_to_merge[each] = [other]
+		for i, j in self.colliding(rects, self.grid.pairs("asteroid", "block", self.block_grid)):
+			each = self.asteroids[i]
+			each.dx *= 0.5
+			each.dy *= 0.5
+			object_removal.add(j)
+
+		edge = (kind == ROCKET) & ((x - radius <= 0) | (x + radius >= windowWidth) | (y - radius <= 0) | (y + radius >= windowHeight))
+		if edge.any():
+			for i in self.rockets:
+				if edge[slot[i]]:
+					object_removal.add(i)
+					self.hits.append((self.frame, i, "edge", None))
+
+		for i, j in self.colliding(rects, self.grid.pairs("rocket", "rocket")):
+			object_removal.add(i)
+			object_removal.add(j)
+			self.trails.keep(self.rockets[i].trail)
+			self.hits.append((self.frame, i, "rocket", j))
+
+		for i, j in self.colliding(rects, self.grid.pairs("rocket", "asteroid")):
+			each, other = self.rockets[i], self.asteroids[j]
+			object_removal.add(i)
+			other.rocket_explosion(each.radius, each.mass, each.x, each.y, each.dx, each.dy)
+			self.trails.keep(each.trail)
+			self.hits.append((self.frame, i, "asteroid", j))
+
+		for i, j in self.colliding(rects, self.grid.pairs("rocket", "block", self.block_grid)):
+			object_removal.add(i)
+			object_removal.add(j)
+			self.trails.keep(self.rockets[i].trail)
+			self.hits.append((self.frame, i, "block", j))
+
+		#Rockets against the sun (column 0) and the black holes
+		hit = self.touching_static(rects, list(self.rockets), static)
+		for i, row in zip(self.rockets, hit):
+			if not any(row):
+				continue
+			each = self.rockets[i]
+			for j, touching in zip(black_hole_keys, row[1:]):
+				if touching:
+					object_removal.add(i)
+					self.trails.keep(each.trail)
+					self.hits.append((self.frame, i, "black_hole", self.black_holes[j].id))
+
+			if row[0]:
+				if not i in object_removal:
+					object_removal.add(i)
+					self.trails.keep(each.trail)
+					self.score += 10*len(self.asteroids)
+					self.hits.append((self.frame, i, "sun", self.sun.id))
+
+		for each in asteroids_to_merge:
+			if not each.id in object_removal:
+				for other in asteroids_to_merge[each]:
+					if not other.id in object_removal:
+						object_removal.add(other.id)
+						each.grow(other.radius, other.mass, other.x, other.y, other.dx, other.dy)
+
+		#Merging moved and grew asteroids
+		if asteroids_to_merge:
+			rects = self.rects()
+		hit = self.touching_static(rects, list(self.asteroids), static)
+		for i, row in zip(self.asteroids, hit):
+			if not any(row):
+				continue
+			each = self.asteroids[i]
+			if row[0]:
+				self.sun.merge(each)
+				if not i in object_removal:
+					object_removal.add(i)
+
+			for j, touching in zip(black_hole_keys, row[1:]):
+				if touching:
+					self.black_holes[j].black_merge(each)
+					object_removal.add(i)
+
+		for each in object_removal:
+			if each in self.asteroids:
+				del self.asteroids[each]
+				self.entities.remove(each)
+			elif each in self.rockets:
+				del self.rockets[each]
+				self.entities.remove(each)
+			elif each in self.blocks:
+				block = self.blocks[each]
+				self.spawn_asteroid(block.x + block.size // 2, block.y + block.size // 2)
+				if self.static_changes is not None:
+					self.static_changes.append((block.x, block.y, block.size, block.size))
+				self.block_grid.remove_many([("block", each)])
+				del self.blocks[each]
+				self.entities.remove(each)
+
+	#Everything that does not move: background, Earth, the sun, black holes
+	#and blocks as last drawn. Paints the static layer, clipped to area
+	def draw_background(self, surface, area):
+		surface.fill((0, 0, 0, 100), area)
+
+		surface.blit(self.bg, (0,0))
+		surface.blit(self.Earth, (12, windowHeight // 2 - 10))
+		for image, x, y in self.drawn_suns:
+			surface.blit(image, (x, y))
+		for x, y, size in self.drawn_blocks:
+			if area.colliderect((x, y, size, size)):
+				surface.blit(cache.scaled(self.block_image, (size, size)), (x, y))
+
+	#Copies what a frame draws into snapshot, see Snapshot
+	def capture(self, snapshot, alpha=1.0):
+		store = self.entities
+		slots = store.slots(list(self.asteroids))
+		snapshot.frame, snapshot.score, snapshot.finished, snapshot.alpha = self.frame, self.score, self.finished(), alpha
+		snapshot.ids, snapshot.x, snapshot.y, snapshot.radius = store.ids[slots], store.x[slots], store.y[slots], store.radius[slots]
+		#Steps replace previous instead of changing it, so it can be shared
+		snapshot.previous = self.previous
+		snapshot.rockets = [each.trail.copy() for each in self.rockets.values()]
+		snapshot.trails = [trail.copy() for trail in self.trails.trails]
+		snapshot.trail_frame = self.trails.frame
+		snapshot.statics = None
+		if self.static_changes is None or self.static_changes:
+			suns = [(each.image, each.x - each.radius, each.y - each.radius) for each in [self.sun] + list(self.black_holes.values())]
+			ids, x, y, size = self.block_rows()
+			blocks = list(zip(x, y, size))
+			snapshot.statics = (suns, blocks, self.static_changes)
+		self.static_changes = []
+		snapshot.counts = {"asteroids": len(self.asteroids), "rockets": len(self.rockets), "blocks": len(self.blocks), "trails": len(self.trails.trails)}
+		self.profiler.lap("capture")
+		return snapshot
+
+	#Draws a snapshot, asteroids alpha of the way from before its last step
+	def render(self, snapshot):
+		if self.static_layer is None:
+			self.static_layer = StaticLayer(self.window.get_size(), self.draw_background)
+		if snapshot.statics is not None:
+			self.drawn_suns, self.drawn_blocks, regions = snapshot.statics
+			if regions is None:
+				self.static_layer.invalidate()
+			for rect in regions or []:
+				self.static_layer.invalidate(rect)
+		self.static_layer.draw(self.window, self.renderer)
+		self.profiler.lap("background")
+
+		rects = self.trails.draw(self.window, snapshot.rockets, snapshot.trail_frame)
+		x, y = snapshot.x, snapshot.y
+		if snapshot.alpha < 1 and snapshot.previous is not None:
+			ids, previous_x, previous_y = snapshot.previous
+			x = interpolate(ids, previous_x, snapshot.ids, x, snapshot.alpha)
+			y = interpolate(ids, previous_y, snapshot.ids, y, snapshot.alpha)
+		for x, y, radius in zip(x.tolist(), y.tolist(), snapshot.radius.tolist()):
+			asteroid = cache.rotozoomed(self.asteroid_image, 0, radius * 2.0 / 1087)
+			rects.append(self.window.blit(asteroid, (x - radius, y - radius)))
+		self.profiler.lap("sprites")
+		rects += self.trails.draw(self.window, snapshot.trails, snapshot.trail_frame)
+		self.profiler.lap("trails")
+		rects.append(self.render_score(score=snapshot.score))
+		rects.append(self.profiler.draw(self.window))
+		if self.renderer is not None:
+			for rect in rects:
+				self.renderer.mark(rect)
+
+	def draw(self, alpha=1.0):
+		self.render(self.capture(Snapshot(), alpha))
+
+	#Runs a headless game as fast as possible. shots maps a frame number to the
+	#mouse position of a click on that frame. Returns (score, [shots, time, score])
+	def simulate(self, max_frames, shots=None, num_asteroids=7):
+		shots = shots or {}
+		self.setup(num_asteroids)
+		while self.frame < max_frames and not self.finished():
+			if self.frame in shots:
+				self.fire(shots[self.frame])
+			self.step()
+		return self.score, [self.shots, self.get_ticks() // 1000, self.score]
+
+	#Plays back a recorded game from the same seed. Runs uncapped unless
+	#realtime, which steps at the game's rate and draws at render_FPS. Returns the score
+	def play(self, log, realtime=False):
+		length = log.frames(REPLAY_NAME)
+		if not realtime or self.headless:
+			return self.simulate(length, log.clicks())[0]
+		clicks = log.clicks()
 		clock = pygame.time.Clock()
-		paused = False
-		self.generate_asteroids(7)
-		self.generate_blocks(self.read_pattern())
-		start_time = pygame.time.get_ticks()
-
-		while not self.b_game_over:
-			asteroids_to_merge = {}
-			object_removal = set()
-			keys = pygame.key.get_pressed()
-			mouse_press = pygame.mouse.get_pressed()[0]
-			if keys[pygame.K_ESCAPE]:
-				exit()
-			if keys[pygame.K_q]:
-				exit()
-			if keys[pygame.K_u]:
-				exit()
-			if mouse_press and pygame.time.get_ticks() - self.last_shot >= self.delay:
-				if not self.first_shot:
-					self.first_shot = True
-				self.last_shot = pygame.time.get_ticks()
-				mouse_pos = pygame.mouse.get_pos()
-				magnitude = math.sqrt(mouse_pos[0] ** 2 + ((windowHeight // 2) - mouse_pos[1]) ** 2)
-				mouse_dx = mouse_pos[0] / magnitude * 3
-				mouse_dy = (mouse_pos[1] - (windowHeight // 2)) / magnitude * 3
-				self.rockets[self.counter] = Rocket(self, mouse_dx, mouse_dy, self.counter, self.rocket_radius)
-				self.counter += 1
-				self.shots += 1
-				# self.ammo -= 1
+		timer = FixedStep(self.FPS)
+		self.setup()
+		while self.frame < length and not self.finished():
 			for event in pygame.event.get():
-				if event.type == pygame.KEYUP:
-					if event.key == pygame.K_p:
-						if not paused:
-							paused = True
-						else:
-							paused = False
-					# if event.key == pygame.K_s:
-					# 	self.spawn_asteroid()
-
 				if event.type == pygame.QUIT:
+					return self.score
+			for i in range(timer.advance()):
+				if self.frame >= length or self.finished():
+					break
+				if self.frame in clicks:
+					self.fire(clicks[self.frame])
+				self.step()
+			self.draw(timer.alpha())
+			present(self.renderer)
+			clock.tick(self.render_FPS)
+		return self.score
+
+	#Plain data copy of the world, picklable so it can be sent to other
+	#processes. restore() on a fresh Game rebuilds it
+	def snapshot(self):
+		return {
+			"seed": self.seed,
+			"random": self.random.getstate(),
+			"frame": self.frame,
+			"counter": self.counter,
+			"score": self.score,
+			"shots": self.shots,
+			"last_shot": self.last_shot,
+			"first_shot": self.first_shot,
+			"level_file": self.level_file,
+			"asteroids": [(each.id, each.x, each.y, each.dx, each.dy, each.radius, each.mass) for each in self.asteroids.values()],
+			"rockets": [(each.id, each.x, each.y, each.dx, each.dy, each.radius, each.mass) for each in self.rockets.values()],
+			"blocks": list(zip(*self.block_rows())),
+			"sun": (self.sun.id, self.sun.x, self.sun.y, self.sun.radius, self.sun.mass, self.sun.center_radius),
+			#Black holes are stored under a different key than their id
+			"black_holes": [(key, each.id, each.x, each.y, each.radius, each.mass, each.center_radius) for key, each in self.black_holes.items()],
+		}
+
+	def restore(self, state):
+		self.seed = state["seed"]
+		self.random.setstate(state["random"])
+		self.frame = state["frame"]
+		self.counter = state["counter"]
+		self.score = state["score"]
+		self.shots = state["shots"]
+		self.last_shot = state["last_shot"]
+		self.first_shot = state["first_shot"]
+		self.level_file = state["level_file"]
+		self.entities.clear()
+		self.previous = None
+		self.asteroids = {}
+		for id, x, y, dx, dy, radius, mass in state["asteroids"]:
+			self.asteroids[id] = Asteroid(self, x, y, dx, dy, id, self.asteroid_image, radius)
+			self.asteroids[id].mass = mass
+		self.rockets = {}
+		for id, x, y, dx, dy, radius, mass in state["rockets"]:
+			rocket = Rocket(self, dx, dy, id, radius)
+			rocket.x, rocket.y, rocket.mass = x, y, mass
+			self.rockets[id] = rocket
+		self.blocks.clear()
+		self.block_grid.clear()
+		blocks = np.array(state["blocks"], dtype=float).reshape(-1, 4)
+		self.add_blocks([id for id, x, y, size in state["blocks"]], blocks[:, 1], blocks[:, 2], blocks[:, 3])
+		id, x, y, radius, mass, center_radius = state["sun"]
+		self.sun = Sun(self, id, x, y, radius)
+		self.sun.mass, self.sun.center_radius = mass, center_radius
+		self.black_holes = {}
+		for key, id, x, y, radius, mass, center_radius in state["black_holes"]:
+			black_hole = Sun(self, id, x, y, radius)
+			black_hole.mass, black_hole.center_radius = mass, center_radius
+			black_hole.image = self.black_hole_image
+			black_hole.kind = BLACK_HOLE
+			self.black_holes[key] = black_hole
+		self.static_changes = None
+		return self
+
+	#Game loop. Physics steps at FPS whatever the frame rate, a slow frame is
+	#caught up with extra steps before drawing. When threaded, a frame's steps
+	#run on a worker thread while the frame before is drawn
+	def run(self):
+		clock = pygame.time.Clock()
+		timer = FixedStep(self.FPS)
+		paused = False
+		self.setup()
+		start_time = self.get_ticks()
+		pipeline = Pipeline(self.advance, self.capture(Snapshot()), Snapshot()) if self.threaded else None
+		snapshot = pipeline.front if pipeline is not None else Snapshot()
+
+		try:
+			while not self.b_game_over:
+				self.profiler.start()
+				keys = pygame.key.get_pressed()
+				mouse_press = pygame.mouse.get_pressed()[0]
+				if keys[pygame.K_ESCAPE]:
 					exit()
-			self.window.fill((0, 0, 0, 100))
-
-			self.window.blit(self.bg, (0,0))
-			self.window.blit(self.Earth, (12, windowHeight // 2 - 10))
-			self.sun.draw()
-
-			
-
-			for i in self.asteroids:
-				each = self.asteroids[i]
-				each.move()
-				if each.x + each.radius <= -10 or each.x - each.radius >= windowWidth + 10:
-					self.success = 0
-					object_removal.add(each.id)
-				elif each.y + each.radius <= -10 or each.y - each.radius >= windowHeight + 10:
-					self.success = 0
-					object_removal.add(each.id)
-
-				for j in self.asteroids:
-					if j == i:
-						continue
-					other = self.asteroids[j]
-					if self.check_collisions(each.rect(), other.rect()) or self.check_collisions(other.rect(), each.rect()):
-						if each in asteroids_to_merge:
-							asteroids_to_merge[each].append(other)
-						else:
-							asteroids_to_merge[each] = [other]
-				for j in self.blocks:
-					other = self.blocks[j]
-					if self.check_collisions(each.rect(), other.rect()) or self.check_collisions(other.rect(), each.rect()):
-						each.dx *= 0.5
-						each.dy *= 0.5
-						object_removal.add(other.id)
-			for b in self.black_holes:
-				black_hole = self.black_holes[b]
-				black_hole.draw()
-			for b in self.blocks:
-				block = self.blocks[b]
-				block.draw()
-			for i in self.rockets:
-				each = self.rockets[i]
-				each.move()
-				if each.x - each.radius <= 0 or each.x + each.radius >= windowWidth or each.y - each.radius <= 0 or each.y + each.radius >= windowHeight:
-					object_removal.add(each.id)
-				for j in self.rockets:
-					if j == i:
-						continue
-					other = self.rockets[j]
-					if self.check_collisions(each.rect(), other.rect()) or self.check_collisions(other.rect(), each.rect()):
-						object_removal.add(each.id)
-						object_removal.add(other.id)
-						self.asteroid_trail.append(each.positions)
-
-				for j in self.asteroids:
-					other = self.asteroids[j]
-					if self.check_collisions(each.rect(), other.rect()) or self.check_collisions(other.rect(), each.rect()):
-						object_removal.add(each.id)
-						other.rocket_explosion(each.radius, each.mass, each.x, each.y, each.dx, each.dy)
-						self.asteroid_trail.append(each.positions)
-
-				for j in self.blocks:
-					other = self.blocks[j]
-					if self.check_collisions(each.rect(), other.rect()) or self.check_collisions(other.rect(), each.rect()):
-						object_removal.add(each.id)
-						object_removal.add(other.id)
-						self.asteroid_trail.append(each.positions)
-
-				for j in self.black_holes:
-					other = self.black_holes[j]
-					if self.check_collisions(each.rect(), other.rect()) or self.check_collisions(other.rect(), each.rect()):
-						object_removal.add(each.id)
-						self.asteroid_trail.append(each.positions)
-
-				if self.check_collisions(each.rect(), self.sun.rect()) or self.check_collisions(self.sun.rect(), each.rect()):
-					if not each.id in object_removal:
-						object_removal.add(each.id)
-						self.asteroid_trail.append(each.positions)
-						self.score += 10*len(self.asteroids)
-				each.draw()
-
-			for each in asteroids_to_merge:
-				if not each.id in object_removal:
-					for other in asteroids_to_merge[each]:
-						if not other.id in object_removal:
-							object_removal.add(other.id)
-							each.grow(other.radius, other.mass, other.x, other.y, other.dx, other.dy)
-
-			for i in self.asteroids:
-				each = self.asteroids[i]
-				if self.check_collisions(each.rect(), self.sun.rect()) or self.check_collisions(self.sun.rect(), each.rect()):
-					self.sun.merge(each)
-					if not each.id in object_removal:
-						object_removal.add(each.id)
-
-				for j in self.black_holes:
-					other = self.black_holes[j]
-					if self.check_collisions(each.rect(), other.rect()) or self.check_collisions(other.rect(), each.rect()):
-						other.black_merge(each)
-						object_removal.add(each.id)
-
-			for each in object_removal:
-				if each in self.asteroids:
-					del self.asteroids[each]
-				elif each in self.rockets:
-					del self.rockets[each]
-				elif each in self.blocks:
-					self.spawn_asteroid(self.blocks[each].x + self.blocks[each].size // 2, self.blocks[each].y + self.blocks[each].size // 2)
-					del self.blocks[each]
-
-			for each in self.asteroids:
-				self.asteroids[each].draw()
-			self.draw_trails()
-			self.render_score()
-
-			pygame.display.flip()
-			clock.tick(self.FPS)
-			curr_time = pygame.time.get_ticks()
-
-			if len(self.asteroids) <= 0 and len(self.blocks) <= 0:
-				new_time = (pygame.time.get_ticks() - start_time)//1000
-				return self.game_over(), self.score, [self.shots, new_time, self.score]
-	def render_score(self, color =(200,200,200)):
-		score_str = "Score: " + str(self.score)
-		score_font = pygame.font.SysFont("Courier", 32, True)
+				if keys[pygame.K_q]:
+					exit()
+				if keys[pygame.K_u]:
+					exit()
+				click = pygame.mouse.get_pos() if mouse_press else None
+				for event in pygame.event.get():
+					if event.type == pygame.KEYUP:
+						if event.key == pygame.K_p:
+							if not paused:
+								paused = True
+							else:
+								paused = False
+						if event.key == pygame.K_F3:
+							self.profiler.toggle_overlay()
+						if event.key == pygame.K_F4:
+							self.profiler.export("profile.csv")
+						# if event.key == pygame.K_s:
+						# 	self.spawn_asteroid()
+
+					if event.type == pygame.QUIT:
+						exit()
+				self.profiler.lap("input")
+
+				job = (timer.advance(), click, timer.alpha())
+				if pipeline is None:
+					self.render(self.advance(job, snapshot))
+				else:
+					pipeline.submit(job)
+					self.render(snapshot)
+				self.profiler.lap("hud")
+
+				present(self.renderer)
+				self.profiler.lap("present")
+				if pipeline is not None:
+					#Time spent waiting for the worker
+					snapshot = pipeline.swap()
+					self.profiler.lap("physics")
+				clock.tick(self.render_FPS)
+				self.profiler.lap("wait")
+				self.profiler.end(steps=job[0], **snapshot.counts)
+
+				if snapshot.finished:
+					new_time = (self.get_ticks() - start_time)//1000
+					return self.game_over(), self.score, [self.shots, new_time, self.score]
+		finally:
+			if pipeline is not None:
+				pipeline.close()
+
+	def render_score(self, color =(200,200,200), score=None):
+		score_str = "Score: " + str(self.score if score is None else score)
+		score_font = cache.font("Courier", 32, True)
 		score_size = self.font.size(score_str)
-		render_score = score_font.render(score_str, 1, color)
-		self.window.blit(render_score, (windowWidth // 2 - score_size[0] // 4, 10 + score_size[1] // 2))
+		render_score = cache.render(score_font, score_str, color)
+		return self.window.blit(render_score, (windowWidth // 2 - score_size[0] // 4, 10 + score_size[1] // 2))
 	def game_over(self):
 		clock = pygame.time.Clock()
 		curr_time = pygame.time.get_ticks()
@@ -538,14 +868,14 @@ class Game:
 
 			self.window.fill((255, 255, 255, 200))
 			game_over_str_size = self.font.size(self.game_over_str)
-			renderGameOver = self.font.render(self.game_over_str, 1, (0, 0, 0))
+			renderGameOver = cache.render(self.font, self.game_over_str, (0, 0, 0))
 			self.window.blit(renderGameOver, (windowWidth // 2 - game_over_str_size[0] // 2, windowHeight // 2 - game_over_str_size[1] // 2))
 			self.render_score((0,0,0))
 			if pygame.time.get_ticks() - curr_time > 1000:
 				retry_str = "Press l to see the leaderboard."
-				retry_font = pygame.font.SysFont("Courier", 32, True)
+				retry_font = cache.font("Courier", 32, True)
 				retry_size = retry_font.size(retry_str)
-				render_retry = retry_font.render(retry_str, 1, (0,0,0))
+				render_retry = cache.render(retry_font, retry_str, (0,0,0))
 				self.window.blit(render_retry, (windowWidth // 2 - retry_size[0] // 2, windowHeight // 2 + retry_size[1] // 2))
 
 			pygame.display.flip()
@@ -587,22 +917,12 @@ class Game:
 			# 	self.render_inst(instructions[index + 1], 26)
 			pygame.display.flip()
 			clock.tick(self.FPS)
-	def leaderboard(self, lines, name):
+	#Saves this game to store and shows the top ten until SPACE is pressed.
+	#shots is the [shots, seconds, score] list run() returns
+	def leaderboard(self, store, name, shots):
 		clock = pygame.time.Clock()
-		flag = False
-		index = 0
-		leaderboard = []
-		for i in range(len(lines)):
-			lines[i][1] = int(lines[i][1])
-			if self.score >= lines[i][1] and not flag:
-				lines[i] = [name, self.score]
-				flag = True
-
-		lines = np.array(lines)
-
-		lines = np.sort(lines, axis=1)
-
-		write(lines)
+		store.add(name, self.score, shots[0], shots[1])
+		leaderboard = store.top(10)
 		while True:
 			keys = pygame.key.get_pressed()
 			if keys[pygame.K_ESCAPE]:
@@ -619,53 +939,36 @@ class Game:
 						return leaderboard
 			self.window.fill((255, 255, 255, 200))
 			instruction_str = "Press SPACE to play again."
-			renderFont = pygame.font.SysFont("Courier", 32, True)
+			renderFont = cache.font("Courier", 32, True)
 			instruction_str_size = renderFont.size(instruction_str)
-			renderInstruction = renderFont.render(instruction_str, 1, (0, 0, 0))
+			renderInstruction = cache.render(renderFont, instruction_str, (0, 0, 0))
 			self.window.blit(renderInstruction, (windowWidth // 2 - instruction_str_size[0] // 2, windowHeight - 48))
 
 			leaderboard_str = "Leaderboard"
-			renderFont = pygame.font.SysFont("Courier", 48, True)
+			renderFont = cache.font("Courier", 48, True)
 			leaderboard_str_size = renderFont.size(leaderboard_str)
-			renderLeaderboard = renderFont.render(leaderboard_str, 1, (0, 0, 0))
+			renderLeaderboard = cache.render(renderFont, leaderboard_str, (0, 0, 0))
 			self.window.blit(renderLeaderboard, (windowWidth // 2 - leaderboard_str_size[0] // 2, 22))
 			height = 22 + leaderboard_str_size[1]
 
-			for each in lines:
-				if len(each) != 2:
-					continue
+			for each in leaderboard:
 				score_str = str(each[0]) + ": " + str(each[1])
-				renderFont = pygame.font.SysFont("Courier", 32, True)
+				renderFont = cache.font("Courier", 32, True)
 				score_str_size = renderFont.size(score_str)
-				renderScore = renderFont.render(score_str, 1, (0, 0, 0))
+				renderScore = cache.render(renderFont, score_str, (0, 0, 0))
 				self.window.blit(renderScore, (windowWidth // 2 - score_str_size[0] // 2, height))
 				height += score_str_size[1] + 4
 
 			pygame.display.flip()
 			clock.tick(self.FPS)
 	def render_inst(self, instruction_str, offset=0):
-		renderFont = pygame.font.SysFont("Courier", 22, True)
+		renderFont = cache.font("Courier", 22, True)
 		instruction_str_size = renderFont.size(instruction_str)
-		renderInstruction = renderFont.render(instruction_str, 1, (0, 0, 0))
+		renderInstruction = cache.render(renderFont, instruction_str, (0, 0, 0))
 		self.window.blit(renderInstruction, (windowWidth // 2 - instruction_str_size[0] // 2, windowHeight // 2 - instruction_str_size[1] // 2 + offset))
 
-def read():
-	"""Reads in the file"""
-	file = open("leaderboard.txt")
-	lines = [line.rstrip('\n').split(',') for line in file.readlines()]
-	return lines
-
-def write(leaderboard):
-	file = open("leaderboard.txt", "w")
-	file.truncate(0)
-	for i in range(min(len(leaderboard), 10)):
-		if len(leaderboard[i]) != 2:
-			continue
-		write_out = str(leaderboard[i][0]) + "," + str(leaderboard[i][1]) + "\n"
-		file.write(write_out)
-	file.close()
-
-def write(shots):
+#Appends a game's [shots, seconds, score] to shots.txt
+def write_shots(shots):
 	file = open("shots.txt", "a")
 	for each in shots:
 		file.write(str(each) + " ")
@@ -673,17 +976,40 @@ def write(shots):
 	file.close()
 
 
+#Plays a recording made with --record, headless and uncapped unless --realtime
+def play_replay(path):
+	game, score, seconds = replay.play_file(path, lambda window, seed: Game(window, seed=seed), "--realtime" in sys.argv, (windowWidth, windowHeight), "Asteroids replay")
+	print("Score %d after %d frames (%.2fs)" % (score, game.frame, seconds))
+
 def main():
+	if replay.option(sys.argv, "--replay") is not None:
+		play_replay(replay.option(sys.argv, "--replay"))
+		return
+	record = replay.option(sys.argv, "--record")
 	name = input("Enter your name: ")
-	lines = read()
+	store = scores.ScoreStore("scores")
+	if store.count() == 0 and os.path.exists("leaderboard.txt"):
+		store.import_text("leaderboard.txt")
 	window = pygame.display.set_mode((windowWidth, windowHeight), pygame.FULLSCREEN)
 	pygame.display.set_caption("Asteroids")
 	pygame.font.init()
 	play = True
+	round_number = 0
 	while play:
-		game = Game(window)
+		round_number += 1
+		game = Game(window, dirty="--dirty" in sys.argv, profile="--profile" in sys.argv, threaded="--threaded" in sys.argv)
+		if replay.option(sys.argv, "--render-fps") is not None:
+			game.render_FPS = int(replay.option(sys.argv, "--render-fps"))
 		game.tutorial()
-		play, score, shots = game.run()
-		write(shots)
-		leaderboard = game.leaderboard(lines, name)
-main()
+		if record is not None:
+			game.recorder = replay.Recorder(replay.round_path(record, round_number), REPLAY_NAME, game.seed, game.FPS)
+		try:
+			play, score, shots = game.run()
+		finally:
+			if game.recorder is not None:
+				game.recorder.close(game.frame)
+		write_shots(shots)
+		leaderboard = game.leaderboard(store, name, shots)
+
+if __name__ == "__main__":
+	main()
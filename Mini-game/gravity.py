@@ -0,0 +1,339 @@
+import os
+import numpy as np
+from engine import field
+
+#Range cutoffs (in pixels) for each group of attractors, -1 means unlimited
+ASTEROID_RANGE = 80
+ROCKET_RANGE = -1
+STATIC_RANGE = 300
+
+#Number of query points handled at once, bounds the size of the pairwise arrays
+CHUNK = 1024
+
+#Quadtree depth used for Morton codes (16 bits per axis)
+MAX_DEPTH = 16
+
+#Within this many lattice spacings of the sun or a black hole the pull changes
+#too fast to interpolate, so it is computed exactly
+LATTICE_NEAR = 8
+
+class GravityField:
+	"""Holds every attractor in the world as contiguous arrays and computes
+	accelerations for many bodies in one vectorized pass.
+
+	mode is "exact" (all pairs) or "barnes_hut", where asteroids and rockets
+	are approximated with a quadtree and theta is the opening angle.
+
+	With bounds (width, height) the sun and black holes are read from a
+	StaticField lattice with the given spacing instead of being summed."""
+	def __init__(self, mode="exact", theta=0.5, leaf_size=4, bounds=None, spacing=4):
+		if mode not in ("exact", "barnes_hut"):
+			raise ValueError("Unknown gravity mode: " + str(mode))
+		self.mode = mode
+		self.theta = theta
+		self.leaf_size = leaf_size
+		self.bounds = bounds
+		self.spacing = spacing
+		self.static = None
+		self.static_changed = False
+		self.trees = []
+		self.x = np.zeros(0)
+		self.y = np.zeros(0)
+		self.mass = np.zeros(0)
+		self.ids = np.zeros(0, dtype=np.int64)
+		#Squared cutoff per attractor (inf for unlimited), rockets ignore the static cutoff
+		self.range_sq = np.zeros(0)
+		self.rocket_range_sq = np.zeros(0)
+
+	def load(self, game):
+		#Snapshot the attractors at the start of a frame, straight from the
+		#game's entity store
+		store = game.entities
+		groups = [
+			(store.slots(game.asteroids), ASTEROID_RANGE, ASTEROID_RANGE),
+			(store.slots(game.rockets), ROCKET_RANGE, ROCKET_RANGE),
+			(store.slots([game.sun.id] + [each.id for each in game.black_holes.values()]), STATIC_RANGE, ROCKET_RANGE),
+		]
+		if self.bounds is not None:
+			slots = groups.pop()[0]
+			self.load_static(store.x[slots], store.y[slots], store.mass[slots], store.ids[slots], getattr(game, "level_file", None))
+		self.trees = []
+		if self.mode == "barnes_hut":
+			for slots, body_range, rocket_range in groups[:2]:
+				if len(slots) > 0:
+					self.trees.append(QuadTree(store.x[slots], store.y[slots], store.mass[slots], store.ids[slots], body_range, rocket_range, self.leaf_size))
+			groups = groups[2:]
+		slots = np.concatenate([np.zeros(0, dtype=np.intp)] + [slots for slots, body_range, rocket_range in groups])
+		counts = [len(slots) for slots, body_range, rocket_range in groups]
+		self.x = store.x[slots]
+		self.y = store.y[slots]
+		self.mass = store.mass[slots]
+		self.ids = store.ids[slots]
+		self.range_sq = np.repeat(range_squared([body_range for slots, body_range, rocket_range in groups]), counts)
+		self.rocket_range_sq = np.repeat(range_squared([rocket_range for slots, body_range, rocket_range in groups]), counts)
+
+	#Builds the static lattice for a new set of attractors, or re-weights it
+	#after one of them changed mass
+	def load_static(self, x, y, mass, ids, level_file):
+		key = list(zip(ids.tolist(), x.tolist(), y.tolist()))
+		if self.static is None or self.static.key != key:
+			name = None
+			if level_file is not None:
+				name = os.path.splitext(os.path.basename(level_file))[0]
+			self.static = StaticField(x, y, mass, ids, self.bounds, self.spacing, name)
+		elif self.static_changed:
+			self.static.update(mass)
+		self.static_changed = False
+
+	#Called when the sun or a black hole gains mass
+	def invalidate_static(self):
+		self.static_changed = True
+
+	def accel(self, x, y, ids, scale, rocket):
+		"""Acceleration at each query point.
+
+		x, y, ids, scale (g / mass of the body) and rocket may be scalars or
+		arrays of the same length. Returns two arrays (accel_x, accel_y)."""
+		x, y, ids, scale, rocket = np.broadcast_arrays(np.atleast_1d(x).astype(float), np.atleast_1d(y).astype(float), np.atleast_1d(ids), np.atleast_1d(scale).astype(float), np.atleast_1d(rocket))
+		accel_x = np.zeros(len(x))
+		accel_y = np.zeros(len(x))
+		for start in range(0, len(x), CHUNK):
+			part = slice(start, start + CHUNK)
+			ax, ay = pairwise_accel(x[part], y[part], ids[part], rocket[part], self.x, self.y, self.mass, self.ids, self.range_sq, self.rocket_range_sq)
+			accel_x[part] = ax * scale[part]
+			accel_y[part] = ay * scale[part]
+		for tree in self.trees:
+			ax, ay = tree.accel(x, y, ids, rocket, self.theta)
+			accel_x += ax * scale
+			accel_y += ay * scale
+		if self.bounds is not None:
+			ax, ay = self.static.accel(x, y, ids, rocket)
+			accel_x += ax * scale
+			accel_y += ay * scale
+		return accel_x, accel_y
+
+class StaticField:
+	"""Pull of attractors that never move, the sun and black holes, stored on
+	two lattices: one for bodies (with the static cutoff) and one for rockets
+	(unlimited). Each attractor is stored at unit mass so a merge only
+	re-weights the lattices. The unit lattices are cached on disk under name,
+	normally the level file. Points off the lattice, close to an attractor or
+	on the cutoff edge use the exact sum."""
+	def __init__(self, x, y, mass, ids, bounds, spacing=4, name=None):
+		self.key = list(zip(ids.tolist(), x.tolist(), y.tolist()))
+		self.x = np.array(x, dtype=float)
+		self.y = np.array(y, dtype=float)
+		self.ids = np.array(ids, dtype=np.int64)
+		self.range_sq = range_squared([STATIC_RANGE] * len(ids))
+		self.rocket_range_sq = range_squared([ROCKET_RANGE] * len(ids))
+		self.body = field.Lattice(bounds[0], bounds[1], spacing)
+		self.rocket = field.Lattice(bounds[0], bounds[1], spacing)
+		if name is None:
+			arrays = self.build_units()
+		else:
+			key = (tuple(bounds), spacing, STATIC_RANGE, ROCKET_RANGE, LATTICE_NEAR, self.key)
+			arrays = field.cached("static-" + name, key, self.build_units)
+		self.body_units = arrays["body"]
+		self.rocket_units = arrays["rocket"]
+		self.body_exact = arrays["body_exact"]
+		self.rocket_exact = arrays["rocket_exact"]
+		self.update(mass)
+
+	#Field of every attractor alone at unit mass, shape (attractors, 2, rows,
+	#columns), and which cells must be computed exactly
+	def build_units(self):
+		grid_x, grid_y = self.body.grid()
+		spacing = self.body.spacing
+		#Cell centres, a cell is exact when any part of it may be near an
+		#attractor or cross the cutoff
+		centre_x, centre_y = grid_x[:-1, :-1] + spacing / 2.0, grid_y[:-1, :-1] + spacing / 2.0
+		slack = spacing * 0.75
+		arrays = {"body": [], "rocket": [], "body_exact": np.zeros(centre_x.shape, dtype=bool), "rocket_exact": np.zeros(centre_x.shape, dtype=bool)}
+		for i in range(len(self.x)):
+			#Unlike pairwise_accel, points straight above an attractor are
+			#pulled too, otherwise whole lattice columns would read zero
+			disp_x, disp_y = self.x[i] - grid_x, self.y[i] - grid_y
+			squared_distance = np.maximum(disp_x ** 2 + disp_y ** 2, 1.0)
+			weight = 1.0 / squared_distance ** 1.7
+			centre_distance = np.hypot(self.x[i] - centre_x, self.y[i] - centre_y)
+			near = centre_distance < LATTICE_NEAR * spacing
+			for kind, limit in (("body", self.range_sq[i]), ("rocket", self.rocket_range_sq[i])):
+				inside = np.where(squared_distance <= limit, weight, 0.0)
+				arrays[kind].append(np.stack([inside * disp_x, inside * disp_y]))
+				edge = np.abs(centre_distance - np.sqrt(limit)) < slack
+				arrays[kind + "_exact"] |= near | edge
+		arrays["body"] = np.array(arrays["body"])
+		arrays["rocket"] = np.array(arrays["rocket"])
+		return arrays
+
+	def update(self, mass):
+		self.mass = np.array(mass, dtype=float)
+		self.body.set_values(np.tensordot(self.mass, self.body_units, axes=1))
+		self.rocket.set_values(np.tensordot(self.mass, self.rocket_units, axes=1))
+
+	#Unscaled acceleration like pairwise_accel
+	def accel(self, x, y, ids, rocket):
+		if rocket.all() or not rocket.any():
+			lattice, flags = (self.rocket, self.rocket_exact) if rocket.any() else (self.body, self.body_exact)
+			accel_x, accel_y, cell = lattice.sample(x, y)
+			exact = (cell < 0) | flags.ravel()[cell]
+		else:
+			accel_x = np.zeros(len(x))
+			accel_y = np.zeros(len(x))
+			exact = np.zeros(len(x), dtype=bool)
+			for lattice, flags, chosen in ((self.body, self.body_exact, ~rocket), (self.rocket, self.rocket_exact, rocket)):
+				accel_x[chosen], accel_y[chosen], cell = lattice.sample(x[chosen], y[chosen])
+				exact[chosen] = (cell < 0) | flags.ravel()[cell]
+		if exact.any():
+			accel_x[exact], accel_y[exact] = pairwise_accel(x[exact], y[exact], ids[exact], rocket[exact], self.x, self.y, self.mass, self.ids, self.range_sq, self.rocket_range_sq)
+		return accel_x, accel_y
+
+class QuadTree:
+	"""Barnes-Hut quadtree over one group of attractors, rebuilt every step.
+
+	Bodies are sorted by Morton code so every node covers a contiguous run of
+	the sorted arrays, which lets both the build and the walk run level by
+	level on whole arrays."""
+	def __init__(self, x, y, mass, ids, body_range, rocket_range, leaf_size=4):
+		self.range_sq, self.rocket_range_sq = range_squared([body_range, rocket_range])
+
+		#Square region covering every body
+		left, top = x.min(), y.min()
+		side = max(x.max() - left, y.max() - top, 1.0) * (1 + 1e-9)
+		cells = 1 << MAX_DEPTH
+		grid_x = np.minimum(((x - left) / side * cells).astype(np.uint64), cells - 1)
+		grid_y = np.minimum(((y - top) / side * cells).astype(np.uint64), cells - 1)
+		code = spread_bits(grid_x) | (spread_bits(grid_y) << np.uint64(1))
+		order = np.argsort(code, kind="stable")
+		code = code[order]
+		self.x, self.y, self.mass, self.ids = x[order], y[order], mass[order], ids[order]
+		self.slot = {body_id: i for i, body_id in enumerate(self.ids.tolist())}
+		count = len(code)
+
+		#One array of nodes per level, each node is a run [start, start + count)
+		levels = []
+		for level in range(MAX_DEPTH + 1):
+			prefix = code >> np.uint64(2 * (MAX_DEPTH - level))
+			starts = np.flatnonzero(np.r_[True, prefix[1:] != prefix[:-1]])
+			counts = np.diff(np.r_[starts, count])
+			levels.append((starts, counts, side / (1 << level)))
+			if counts.max() <= leaf_size:
+				break
+
+		starts = []
+		counts = []
+		sizes = []
+		leaves = []
+		first_child = []
+		child_count = []
+		offset = 0
+		for level, (level_starts, level_counts, size) in enumerate(levels):
+			starts.append(level_starts)
+			counts.append(level_counts)
+			sizes.append(np.full(len(level_starts), size))
+			offset += len(level_starts)
+			if level + 1 < len(levels):
+				leaves.append(level_counts <= leaf_size)
+				child_starts = levels[level + 1][0]
+				first = np.searchsorted(child_starts, level_starts)
+				last = np.searchsorted(child_starts, level_starts + level_counts)
+				first_child.append(first + offset)
+				child_count.append(last - first)
+			else:
+				leaves.append(np.ones(len(level_starts), dtype=bool))
+				first_child.append(np.zeros(len(level_starts), dtype=np.int64))
+				child_count.append(np.zeros(len(level_starts), dtype=np.int64))
+		self.start = np.concatenate(starts)
+		self.count = np.concatenate(counts)
+		self.size = np.concatenate(sizes)
+		self.leaf = np.concatenate(leaves)
+		self.first_child = np.concatenate(first_child)
+		self.child_count = np.concatenate(child_count)
+
+		#Mass and centre of mass of every node
+		self.node_mass = np.add.reduceat(self.mass, self.start)
+		self.com_x = np.add.reduceat(self.mass * self.x, self.start) / self.node_mass
+		self.com_y = np.add.reduceat(self.mass * self.y, self.start) / self.node_mass
+
+	def accel(self, x, y, ids, rocket, theta):
+		accel_x = np.zeros(len(x))
+		accel_y = np.zeros(len(x))
+		limit = np.where(rocket, self.rocket_range_sq, self.range_sq)
+		#Sorted position of each query body inside this tree, -1 if not a member
+		position = np.array([self.slot.get(body_id, -1) for body_id in ids.tolist()], dtype=np.int64)
+
+		query = np.arange(len(x))
+		node = np.zeros(len(x), dtype=np.int64)
+		while len(query) > 0:
+			disp_x = self.com_x[node] - x[query]
+			disp_y = self.com_y[node] - y[query]
+			squared_distance = disp_x ** 2 + disp_y ** 2
+
+			#Drop nodes lying entirely outside the range cutoff
+			reach = np.sqrt(limit[query]) + self.size[node] * np.sqrt(2)
+			keep = squared_distance <= reach ** 2
+			query, node = query[keep], node[keep]
+			disp_x, disp_y, squared_distance = disp_x[keep], disp_y[keep], squared_distance[keep]
+
+			inside = (position[query] >= self.start[node]) & (position[query] < self.start[node] + self.count[node])
+			#Nodes straddling the cutoff are opened so the cutoff stays per body
+			within = (np.sqrt(squared_distance) + self.size[node] * np.sqrt(2)) ** 2 <= limit[query]
+			far = ~self.leaf[node] & ~inside & within & (self.size[node] ** 2 < theta ** 2 * squared_distance)
+			ax, ay = pair_accel(disp_x[far], disp_y[far], squared_distance[far], self.node_mass[node[far]], limit[query[far]])
+			accel_x += np.bincount(query[far], ax, len(x))
+			accel_y += np.bincount(query[far], ay, len(x))
+
+			#Leaves are summed body by body
+			leaf = self.leaf[node]
+			leaf_query, body = expand(query[leaf], self.start[node[leaf]], self.count[node[leaf]])
+			body_x = self.x[body] - x[leaf_query]
+			body_y = self.y[body] - y[leaf_query]
+			body_squared = body_x ** 2 + body_y ** 2
+			mass = np.where(self.ids[body] != ids[leaf_query], self.mass[body], 0.0)
+			ax, ay = pair_accel(body_x, body_y, body_squared, mass, limit[leaf_query])
+			accel_x += np.bincount(leaf_query, ax, len(x))
+			accel_y += np.bincount(leaf_query, ay, len(x))
+
+			#Everything else is opened into its children
+			opened = ~leaf & ~far
+			query, node = expand(query[opened], self.first_child[node[opened]], self.child_count[node[opened]])
+		return accel_x, accel_y
+
+def range_squared(ranges):
+	ranges = np.array(ranges, dtype=float)
+	return np.where(ranges >= 0, ranges ** 2, np.inf)
+
+def pairwise_accel(x, y, ids, rocket, ax, ay, mass, attractor_ids, range_sq, rocket_range_sq):
+	#Unscaled pull of every attractor on every query point, force = g * m / d^2.4
+	disp_x = ax[None, :] - x[:, None]
+	disp_y = ay[None, :] - y[:, None]
+	squared_distance = disp_x ** 2 + disp_y ** 2
+	limit = np.where(rocket[:, None], rocket_range_sq[None, :], range_sq[None, :])
+	#Bodies directly above or below each other never pulled horizontally or vertically
+	mask = (squared_distance <= limit) & (attractor_ids[None, :] != ids[:, None]) & (np.abs(disp_x) > 0.01)
+	squared_distance = np.where(mask, squared_distance, 1.0)
+	weight = np.where(mask, mass[None, :] / squared_distance ** 1.7, 0.0)
+	return (weight * disp_x).sum(axis=1), (weight * disp_y).sum(axis=1)
+
+def pair_accel(disp_x, disp_y, squared_distance, mass, limit):
+	#Same force law and cutoffs as pairwise_accel, for a flat list of pairs
+	mask = (squared_distance <= limit) & (np.abs(disp_x) > 0.01)
+	squared_distance = np.where(mask, squared_distance, 1.0)
+	weight = np.where(mask, mass / squared_distance ** 1.7, 0.0)
+	return weight * disp_x, weight * disp_y
+
+def expand(owner, first, count):
+	#Pairs every owner with each index in [first, first + count)
+	total = count.sum()
+	owners = np.repeat(owner, count)
+	offsets = np.arange(total) - np.repeat(np.cumsum(count) - count, count)
+	return owners, np.repeat(first, count) + offsets
+
+def spread_bits(value):
+	#Interleaves zeros between the low 16 bits, for Morton codes
+	value = value & np.uint64(0xFFFF)
+	value = (value | (value << np.uint64(8))) & np.uint64(0x00FF00FF)
+	value = (value | (value << np.uint64(4))) & np.uint64(0x0F0F0F0F)
+	value = (value | (value << np.uint64(2))) & np.uint64(0x33333333)
+	value = (value | (value << np.uint64(1))) & np.uint64(0x55555555)
+	return value
@@ -0,0 +1,150 @@
+"""Binary funloop levels and level packs.
+
+A level is a grid of cell types, one byte per cell, plus a table of free
+entities such as asteroids placed at exact positions. Both are stored
+uncompressed after a small header, so loading maps them straight from the
+file instead of parsing text. A pack is several levels in one file behind an
+index of names and offsets.
+
+	python level.py convert input.txt input.lvl
+	python level.py pack levels.pak input.lvl other.txt
+	python level.py info levels.pak
+"""
+import os
+import struct
+import sys
+import numpy as np
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from engine import atomic
+
+#Cell types, the same numbers the CSV levels use
+EMPTY = 0
+BLOCK = 1
+SUN = 2
+BLACK_HOLE = 3
+
+#Entity kinds
+ASTEROID = 1
+
+MAGIC = b"FLVL"
+VERSION = 1
+#magic, version, cell size, columns, rows, entity count, cells offset, entities offset
+HEADER = struct.Struct("<4sBxHIIIQQ")
+ENTITY = np.dtype([("kind", "u1"), ("x", "<f4"), ("y", "<f4"), ("size", "<f4")])
+
+PACK_MAGIC = b"FPAK"
+#magic, version, level count
+PACK_HEADER = struct.Struct("<4sBxxxI")
+#name, offset, length
+PACK_ENTRY = struct.Struct("<32sQQ")
+
+class Level:
+	"""cells is a (rows, columns) uint8 array of cell types and entities a
+	structured array of ENTITY. Loaded levels hold read-only memory maps."""
+	def __init__(self, cells, entities=None, cell_size=40, name=""):
+		self.cells = cells
+		self.entities = entities if entities is not None else np.zeros(0, dtype=ENTITY)
+		self.cell_size = cell_size
+		self.name = name
+
+	def asteroids(self):
+		return self.entities[self.entities["kind"] == ASTEROID]
+
+	def to_bytes(self):
+		cells = np.ascontiguousarray(self.cells, dtype=np.uint8)
+		entities = np.ascontiguousarray(self.entities, dtype=ENTITY)
+		rows, columns = cells.shape
+		header = HEADER.pack(MAGIC, VERSION, self.cell_size, columns, rows, len(entities), HEADER.size, HEADER.size + cells.nbytes)
+		return header + cells.tobytes() + entities.tobytes()
+
+	def save(self, path):
+		data = self.to_bytes()
+		atomic.write_file(path, lambda file: file.write(data))
+
+#Memory maps the level starting at offset in path
+def load(path, offset=0, name=None):
+	with open(path, "rb") as file:
+		file.seek(offset)
+		magic, version, cell_size, columns, rows, count, cells_offset, entities_offset = HEADER.unpack(file.read(HEADER.size))
+	if magic != MAGIC or version != VERSION:
+		raise ValueError("%s is not a level file" % path)
+	cells = np.zeros((rows, columns), dtype=np.uint8)
+	if rows * columns > 0:
+		cells = np.memmap(path, np.uint8, "r", offset + cells_offset, (rows, columns))
+	entities = np.zeros(0, dtype=ENTITY)
+	if count > 0:
+		entities = np.memmap(path, ENTITY, "r", offset + entities_offset, (count,))
+	if name is None:
+		name = os.path.splitext(os.path.basename(path))[0]
+	return Level(cells, entities, cell_size, name)
+
+def from_csv(path, cell_size=40):
+	cells = np.loadtxt(path, delimiter=",", dtype=np.uint8, ndmin=2)
+	return Level(cells, None, cell_size, os.path.splitext(os.path.basename(path))[0])
+
+class Pack:
+	"""Index of the levels in a pack file, levels are only mapped when loaded"""
+	def __init__(self, path):
+		self.path = path
+		self.index = {}
+		with open(path, "rb") as file:
+			magic, version, count = PACK_HEADER.unpack(file.read(PACK_HEADER.size))
+			if magic != PACK_MAGIC or version != VERSION:
+				raise ValueError("%s is not a level pack" % path)
+			for i in range(count):
+				name, offset, length = PACK_ENTRY.unpack(file.read(PACK_ENTRY.size))
+				self.index[name.rstrip(b"\0").decode()] = (offset, length)
+
+	def names(self):
+		return list(self.index)
+
+	def load(self, name):
+		offset, length = self.index[name]
+		return load(self.path, offset, name)
+
+#Levels are found by name in a pack, so names must be unique and fit the index
+def save_pack(levels, path):
+	names = set()
+	for level in levels:
+		if len(level.name.encode()) > 32:
+			raise ValueError("level name %r is longer than 32 bytes" % level.name)
+		if level.name in names:
+			raise ValueError("two levels are named %r, names in a pack must be unique" % level.name)
+		names.add(level.name)
+	blobs = [level.to_bytes() for level in levels]
+	offset = PACK_HEADER.size + PACK_ENTRY.size * len(levels)
+	index = b""
+	for level, blob in zip(levels, blobs):
+		index += PACK_ENTRY.pack(level.name.encode(), offset, len(blob))
+		offset += len(blob)
+	def write(file):
+		file.write(PACK_HEADER.pack(PACK_MAGIC, VERSION, len(levels)) + index)
+		for blob in blobs:
+			file.write(blob)
+	atomic.write_file(path, write)
+
+#Loads a CSV level, a binary level, or one level of a pack as "pack.pak#name"
+def open_level(path, cell_size=40):
+	if "#" in path:
+		path, name = path.split("#", 1)
+		return Pack(path).load(name)
+	if path.endswith(".lvl"):
+		return load(path)
+	return from_csv(path, cell_size)
+
+def main(argv):
+	if len(argv) >= 3 and argv[0] == "convert":
+		open_level(argv[1]).save(argv[2])
+	elif len(argv) >= 3 and argv[0] == "pack":
+		save_pack([open_level(each) for each in argv[2:]], argv[1])
+	elif len(argv) == 2 and argv[0] == "info":
+		levels = [load(argv[1])] if argv[1].endswith(".lvl") else [Pack(argv[1]).load(name) for name in Pack(argv[1]).names()]
+		for level in levels:
+			counts = np.bincount(np.asarray(level.cells).ravel(), minlength=4)
+			print("%-16s %5d x %-5d blocks %d  suns %d  black holes %d  entities %d" % (level.name, level.cells.shape[1], level.cells.shape[0], counts[BLOCK], counts[SUN], counts[BLACK_HOLE], len(level.entities)))
+	else:
+		print(__doc__)
+		sys.exit(1)
+
+if __name__ == "__main__":
+	main(sys.argv[1:])
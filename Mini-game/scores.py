@@ -0,0 +1,159 @@
+"""Leaderboard and per-game stats shared by every funloop process.
+
+Every finished game is appended to name.log as a fixed-size record and the
+log is never rewritten. The best K games are kept in a small index file,
+name.top, which is updated with a heap and replaced atomically, so a crash
+leaves either the old or the new index. If the index falls behind the log,
+for example after a crash between the two writes, it catches up from the
+records it has not seen yet. All access goes through a lock file so several
+game processes can share one store.
+"""
+import heapq
+import os
+import struct
+import sys
+import time
+import numpy as np
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from engine import atomic
+
+try:
+	import fcntl
+except ImportError:
+	#No advisory locks on this platform, a single game process is still safe
+	fcntl = None
+
+#time, score, shots, seconds played, name
+RECORD = struct.Struct("<dqII32s")
+RECORD_DTYPE = np.dtype([("time", "<f8"), ("score", "<i8"), ("shots", "<u4"), ("seconds", "<u4"), ("name", "S32")])
+INDEX_MAGIC = b"FTOP"
+VERSION = 1
+#magic, version, capacity, number of log records the index has seen
+INDEX_HEADER = struct.Struct("<4sBxxxIQ")
+
+class Lock:
+	"""Holds an fcntl lock on path for the duration of a with block"""
+	def __init__(self, path, exclusive=True):
+		self.path = path
+		self.exclusive = exclusive
+		self.file = None
+
+	def __enter__(self):
+		self.file = open(self.path, "a")
+		if fcntl is not None:
+			fcntl.flock(self.file, fcntl.LOCK_EX if self.exclusive else fcntl.LOCK_SH)
+		return self
+
+	def __exit__(self, *args):
+		if fcntl is not None:
+			fcntl.flock(self.file, fcntl.LOCK_UN)
+		self.file.close()
+
+class ScoreStore:
+	def __init__(self, name="scores", capacity=100):
+		self.log_path = name + ".log"
+		self.index_path = name + ".top"
+		self.lock_path = name + ".lock"
+		self.capacity = capacity
+
+	#Number of whole records in the log, a torn write at the end is ignored
+	def count(self):
+		try:
+			return os.path.getsize(self.log_path) // RECORD.size
+		except OSError:
+			return 0
+
+	def records(self, start=0):
+		"""Log records from number start onwards as a structured array,
+		memory mapped so millions of games do not have to fit in memory."""
+		count = self.count()
+		if count <= start:
+			return np.zeros(0, dtype=RECORD_DTYPE)
+		return np.memmap(self.log_path, RECORD_DTYPE, "r", start * RECORD.size, (count - start,))
+
+	#Appends a finished game and returns its rank on the leaderboard (0 is
+	#best), or None when it did not make the top capacity games
+	def add(self, name, score, shots=0, seconds=0):
+		record = RECORD.pack(time.time(), int(score), int(shots), int(seconds), name.encode()[:32])
+		with Lock(self.lock_path):
+			#Records are appended whole, after any partial record a crash left
+			with open(self.log_path, "ab") as file:
+				file.truncate(self.count() * RECORD.size)
+				file.write(record)
+				file.flush()
+				os.fsync(file.fileno())
+			heap, seen = self.read_index()
+			heap, seen = self.catch_up(heap, seen)
+			self.write_index(heap, seen)
+		sequence = seen - 1
+		ranked = sorted(heap, reverse=True)
+		for rank, entry in enumerate(ranked):
+			if entry[1] == -sequence:
+				return rank
+		return None
+
+	#Min-heap of (score, -sequence, name) holding the best games seen so far,
+	#and how many log records that covers
+	def read_index(self):
+		try:
+			with open(self.index_path, "rb") as file:
+				data = file.read()
+			magic, version, capacity, seen = INDEX_HEADER.unpack_from(data)
+		except (OSError, struct.error):
+			return [], 0
+		if magic != INDEX_MAGIC or version != VERSION or capacity != self.capacity:
+			return [], 0
+		heap = []
+		for score, sequence, name in struct.iter_unpack("<qq32s", data[INDEX_HEADER.size:]):
+			heap.append((score, sequence, name.rstrip(b"\0").decode(errors="replace")))
+		heapq.heapify(heap)
+		return heap, seen
+
+	#Pushes every record the index has not seen, O(log capacity) each
+	def catch_up(self, heap, seen):
+		records = self.records(seen)
+		for i, (score, name) in enumerate(zip(records["score"].tolist(), records["name"].tolist())):
+			entry = (score, -(seen + i), name.decode(errors="replace"))
+			if len(heap) < self.capacity:
+				heapq.heappush(heap, entry)
+			elif entry > heap[0]:
+				heapq.heapreplace(heap, entry)
+		return heap, seen + len(records)
+
+	#Replaces the index file in one rename so readers never see half of it
+	def write_index(self, heap, seen):
+		data = INDEX_HEADER.pack(INDEX_MAGIC, VERSION, self.capacity, seen)
+		for score, sequence, name in heap:
+			data += struct.pack("<qq32s", score, sequence, name.encode()[:32])
+		atomic.write_file(self.index_path, lambda file: file.write(data), sync=True)
+
+	#Best k games as (name, score), best first, older games first on ties
+	def top(self, k=10):
+		with Lock(self.lock_path, exclusive=False):
+			heap, seen = self.read_index()
+			if seen < self.count():
+				heap, seen = self.catch_up(heap, seen)
+		return [(name, score) for score, sequence, name in sorted(heap, reverse=True)[:k]]
+
+	#Totals over every game, or only name's games
+	def stats(self, name=None):
+		records = self.records()
+		if name is not None:
+			records = records[records["name"] == name.encode()[:32]]
+		if len(records) == 0:
+			return {"games": 0}
+		return {
+			"games": len(records),
+			"best": int(records["score"].max()),
+			"mean": float(records["score"].mean()),
+			"shots": int(records["shots"].sum()),
+			"seconds": int(records["seconds"].sum()),
+		}
+
+	#Adds the "name,score" lines of the old text leaderboard
+	def import_text(self, path):
+		with open(path) as file:
+			for line in file:
+				parts = line.strip().split(",")
+				if len(parts) == 2 and parts[1].strip().lstrip("-").isdigit():
+					self.add(parts[0].strip(), int(parts[1]))
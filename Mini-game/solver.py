@@ -0,0 +1,126 @@
+"""Finds the shots that hit each target in a funloop level.
+
+Candidate launch angles are spread evenly over the half circle Earth can
+fire into. Every candidate is fired into its own headless copy of the level
+and simulated until the rocket is destroyed. Candidates run in a process
+pool on every core, and results are cached per level and settings.
+
+	python solver.py --shots 2000
+	python solver.py --level input.txt --seed 3 --out shots.json
+"""
+import argparse
+import hashlib
+import json
+import math
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from engine import atomic
+
+import funloop
+
+CACHE_DIR = ".solver_cache"
+#Bump when results would differ for the same level, so old caches are ignored
+VERSION = 1
+#Rockets are aimed at a point this far from Earth along the launch angle
+AIM_DISTANCE = 500
+
+#Mouse position that makes Game.fire launch at angle (radians, 0 is straight right)
+def aim(angle):
+	return (AIM_DISTANCE * math.cos(angle), funloop.windowHeight // 2 + AIM_DISTANCE * math.sin(angle))
+
+#Evenly spaced angles strictly between straight up and straight down
+def candidate_angles(shots):
+	return [-math.pi / 2 + math.pi * (i + 0.5) / shots for i in range(shots)]
+
+#World and settings every worker process simulates shots in, set by start_worker
+world = None
+
+def start_worker(state, max_frames, gravity_mode):
+	global world
+	world = (state, max_frames, gravity_mode)
+
+#Fires one rocket at angle into a copy of the world. Returns (angle, what it
+#hit, id of that, frames until it hit), what is "timeout" if it never did
+def run_shot(angle):
+	state, max_frames, gravity_mode = world
+	game = funloop.Game(None, gravity_mode).restore(state)
+	game.fire(aim(angle))
+	rocket = game.counter - 1
+	start = game.frame
+	while game.frame - start < max_frames and rocket in game.rockets:
+		game.step()
+	for frame, id, kind, target in game.hits:
+		if id == rocket:
+			return (angle, kind, target, frame - start)
+	return (angle, "timeout", None, max_frames)
+
+def cache_path(state, settings):
+	key = json.dumps([VERSION, state, settings], sort_keys=True, default=list)
+	digest = hashlib.sha1(key.encode()).hexdigest()[:16]
+	name = os.path.splitext(os.path.basename(state["level_file"]))[0]
+	return os.path.join(CACHE_DIR, "%s-%s.json" % (name, digest))
+
+def solve(state, shots=1000, max_frames=1500, workers=None, gravity_mode="exact", use_cache=True):
+	"""Simulates shots candidate angles from the world in state (a
+	Game.snapshot()). Returns one (angle, kind, target, frames) per angle."""
+	settings = {"shots": shots, "max_frames": max_frames, "gravity_mode": gravity_mode}
+	path = cache_path(state, settings)
+	if use_cache and os.path.exists(path):
+		with open(path) as file:
+			return [tuple(each) for each in json.load(file)]
+
+	angles = candidate_angles(shots)
+	workers = workers or os.cpu_count() or 1
+	chunksize = max(1, len(angles) // (workers * 8))
+	with ProcessPoolExecutor(workers, initializer=start_worker, initargs=(state, max_frames, gravity_mode)) as pool:
+		results = list(pool.map(run_shot, angles, chunksize=chunksize))
+
+	if use_cache:
+		atomic.write_cache(path, lambda file: json.dump(results, file), "w")
+	return results
+
+#Groups results by what they hit: {(kind, target): [(angle in degrees, frames), ...]}
+def by_target(results):
+	targets = {}
+	for angle, kind, target, frames in results:
+		targets.setdefault((kind, target), []).append((math.degrees(angle), frames))
+	return targets
+
+#Snapshot of a level loaded from file, with asteroids placed from seed
+def load_level(level_file, seed, num_asteroids):
+	game = funloop.Game(None, seed=seed)
+	game.level_file = level_file
+	game.setup(num_asteroids)
+	return game.snapshot()
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument("--level", default="input.txt", help="level file (default input.txt)")
+	parser.add_argument("--seed", type=int, default=0, help="seed placing the asteroids")
+	parser.add_argument("--asteroids", type=int, default=7)
+	parser.add_argument("--shots", type=int, default=1000, help="number of launch angles to try")
+	parser.add_argument("--frames", type=int, default=1500, help="frames a shot may fly before giving up")
+	parser.add_argument("--workers", type=int, help="processes to use (default: one per core)")
+	parser.add_argument("--gravity", choices=("exact", "barnes_hut"), default="exact")
+	parser.add_argument("--no-cache", action="store_true")
+	parser.add_argument("--out", help="also write every shot as JSON here")
+	args = parser.parse_args()
+
+	state = load_level(args.level, args.seed, args.asteroids)
+	start = time.perf_counter()
+	results = solve(state, args.shots, args.frames, args.workers, args.gravity, not args.no_cache)
+	print("%d shots in %.1fs" % (len(results), time.perf_counter() - start))
+	targets = by_target(results)
+	for (kind, target), shots in sorted(targets.items(), key=lambda item: -len(item[1])):
+		angles = [angle for angle, frames in shots]
+		name = kind if target is None else "%s %d" % (kind, target)
+		print("%-16s %5d hits  %7.2f to %7.2f degrees  fastest %d frames" % (name, len(shots), min(angles), max(angles), min(frames for angle, frames in shots)))
+	if args.out:
+		with open(args.out, "w") as file:
+			json.dump([{"angle": math.degrees(angle), "mouse": aim(angle), "hit": kind, "target": target, "frames": frames} for angle, kind, target, frames in results], file, indent=1)
+
+if __name__ == "__main__":
+	main()
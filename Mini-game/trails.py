@@ -0,0 +1,104 @@
+import numpy as np
+import pygame
+from pygame import gfxdraw
+
+#Trail points start opaque and lose FADE alpha every game step
+START_ALPHA = 255
+FADE = 4
+#Steps a point stays visible, which is also the most points a trail can hold
+LIFETIME = START_ALPHA // FADE + 1
+
+class Trail:
+	"""Fixed-capacity ring buffer of trail points. Each point stores the frame
+	it was added on, so fading needs no per-point updates."""
+	def __init__(self, capacity=LIFETIME):
+		self.capacity = capacity
+		self.x = np.zeros(capacity, dtype=np.int32)
+		self.y = np.zeros(capacity, dtype=np.int32)
+		self.born = np.zeros(capacity, dtype=np.int64)
+		self.head = 0
+		self.count = 0
+
+	def push(self, x, y, frame):
+		if self.count == self.capacity:
+			self.head = (self.head + 1) % self.capacity
+			self.count -= 1
+		index = (self.head + self.count) % self.capacity
+		self.x[index], self.y[index], self.born[index] = int(x), int(y), frame
+		self.count += 1
+
+	#Drops points that have completely faded by frame
+	def expire(self, frame):
+		while self.count > 0 and frame - self.born[self.head] >= LIFETIME:
+			self.head = (self.head + 1) % self.capacity
+			self.count -= 1
+
+	#Independent copy, for drawing while the original keeps changing
+	def copy(self):
+		trail = Trail(self.capacity)
+		trail.x[:], trail.y[:], trail.born[:] = self.x, self.y, self.born
+		trail.head, trail.count = self.head, self.count
+		return trail
+
+	#Oldest to newest indices into the buffers
+	def indices(self):
+		return (self.head + np.arange(self.count)) % self.capacity
+
+class TrailPool:
+	"""Keeps the trails of destroyed rockets until they have faded out, and
+	draws trails with pre-rendered alpha dots."""
+	def __init__(self, radius=3, color=(200, 200, 200)):
+		self.radius = radius
+		self.color = color
+		self.frame = 0
+		self.trails = []
+		self.stamps = None
+
+	#One dot surface per alpha a trail point can have, built on first draw
+	def build_stamps(self):
+		size = self.radius * 2 + 1
+		self.stamps = []
+		for age in range(LIFETIME):
+			color = tuple(self.color) + (START_ALPHA - age * FADE,)
+			stamp = pygame.Surface((size, size), pygame.SRCALPHA)
+			pygame.gfxdraw.aacircle(stamp, self.radius, self.radius, self.radius, color)
+			pygame.gfxdraw.filled_circle(stamp, self.radius, self.radius, self.radius, color)
+			self.stamps.append(stamp)
+
+	#Keeps a destroyed rocket's trail drawing until it fades
+	def keep(self, trail):
+		if trail.count > 0 and trail not in self.trails:
+			self.trails.append(trail)
+
+	#Advances the fade clock, adds where each rocket is now to its trail and
+	#drops kept trails that have faded. Called once per game step so trails
+	#look the same at any frame rate
+	def record(self, rockets):
+		self.frame += 1
+		for rocket in rockets:
+			rocket.trail.push(rocket.x, rocket.y, self.frame)
+		for trail in self.trails:
+			trail.expire(self.frame)
+		self.trails = [trail for trail in self.trails if trail.count > 0]
+
+	#Draws trail as it looks on fade clock frame. Returns the rect covering
+	#the whole trail, or None when it is empty
+	def draw_trail(self, surface, trail, frame):
+		if self.stamps is None:
+			self.build_stamps()
+		trail.expire(frame)
+		if trail.count == 0:
+			return None
+		index = trail.indices()
+		ages = (frame - trail.born[index]).tolist()
+		xs = trail.x[index] - self.radius
+		ys = trail.y[index] - self.radius
+		surface.blits([(self.stamps[age], (x, y)) for age, x, y in zip(ages, xs.tolist(), ys.tolist())], False)
+		size = self.radius * 2 + 1
+		return pygame.Rect(int(xs.min()), int(ys.min()), int(xs.max() - xs.min()) + size, int(ys.max() - ys.min()) + size)
+
+	#Draws trails, such as copies taken with Trail.copy(), as they look on
+	#fade clock frame. Returns the rects drawn over
+	def draw(self, surface, trails, frame):
+		rects = [self.draw_trail(surface, trail, frame) for trail in trails]
+		return [rect for rect in rects if rect is not None]
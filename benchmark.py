@@ -0,0 +1,262 @@
+"""Deterministic benchmarks for both games.
+
+Runs seeded scenarios through the games' step functions and times the
+physics, collision, trail and render phases separately. Rendering uses SDL's dummy
+video driver so no window is opened. Results are written as JSON, and a
+previous results file can be given to --compare to flag regressions.
+
+	python benchmark.py --out results.json
+	python benchmark.py --only funloop_level pong_split --compare results.json
+"""
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import sys
+import time
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+#pygame prints a banner on import, which would end up in the JSON on stdout
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+
+import numpy as np
+import pygame
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+FUNLOOP_DIR = os.path.join(ROOT, "Mini-game")
+PONG_DIR = os.path.join(ROOT, "pong")
+sys.path.insert(0, FUNLOOP_DIR)
+sys.path.insert(0, PONG_DIR)
+
+import funloop
+import pong
+from engine import assets
+from engine import cache
+from engine import integrators
+from engine.loop import present
+from engine.spatial import rects_collide
+
+PHASES = ("physics", "collision", "trails", "render")
+
+class Timer:
+	"""Collects per-step timings for each phase."""
+	def __init__(self):
+		self.samples = {phase: [] for phase in PHASES}
+
+	def measure(self, phase, function, *args):
+		start = time.perf_counter()
+		function(*args)
+		self.samples[phase].append(time.perf_counter() - start)
+
+	#Runs game.step(*args), the same step the game loop runs, with the game's
+	#profiler timing it. laps maps the profiler's laps to phases
+	def step(self, game, laps, *args):
+		game.profiler.start()
+		game.step(*args)
+		game.profiler.end()
+		record = game.profiler.records[-1]
+		for lap, phase in laps.items():
+			if lap + "_ms" in record:
+				self.samples[phase].append(record[lap + "_ms"] / 1000.0)
+
+	def summary(self):
+		result = {}
+		for phase, samples in self.samples.items():
+			if len(samples) == 0:
+				continue
+			samples = np.array(samples) * 1000.0
+			result[phase] = {
+				"total_ms": float(samples.sum()),
+				"mean_ms": float(samples.mean()),
+				"p95_ms": float(np.percentile(samples, 95)),
+				"max_ms": float(samples.max()),
+			}
+		return result
+
+#Scatters num asteroids over the open parts of the field, one per cell of an
+#even grid and small enough that neighbours do not touch. generate_asteroids
+#packs them into a strip by Earth, where a large N merges down to a handful
+#within a few steps
+def spread_asteroids(game, num, rng):
+	static = np.array([each.rect() for each in game.blocks.values()] + [(each.x - each.radius, each.y - each.radius, each.radius * 2, each.radius * 2) for each in [game.sun] + list(game.black_holes.values())], dtype=float)
+	open_area = 1.0 - (static[:, 2] * static[:, 3]).sum() / (funloop.windowWidth * funloop.windowHeight)
+	side = math.sqrt(funloop.windowWidth * funloop.windowHeight * open_area / num) * 0.9
+	radius = max(1, min(8, int(side / 3)))
+	cells = np.array([((column + 0.5) * side, (row + 0.5) * side) for row in range(int(funloop.windowHeight // side)) for column in range(int(funloop.windowWidth // side))])
+	#Cells near a block, the sun or a black hole are left empty
+	squares = np.column_stack([cells - side, np.full((len(cells), 2), side * 2)])
+	clear = ~rects_collide(squares[:, None, :], static[None, :, :]).any(axis=1)
+	spots = [(x + rng.uniform(-0.2, 0.2) * side, y + rng.uniform(-0.2, 0.2) * side) for x, y in cells[clear].tolist()]
+	for x, y in rng.sample(spots, min(num, len(spots))):
+		game.spawn_asteroid(x, y, radius)
+
+def funloop_scenario(window, steps, num_asteroids, gravity_mode, seed, integrator="rk4", static_field=False, spread=False):
+	os.chdir(FUNLOOP_DIR)
+	game = funloop.Game(window, gravity_mode, integrator=integrator, static_field=static_field, profile=True, seed=seed)
+	rng = random.Random(seed)
+	if spread:
+		game.setup(0)
+		spread_asteroids(game, num_asteroids, rng)
+	else:
+		game.setup(num_asteroids)
+	#Gravity only switches on after the first shot, fire a fan of rockets from the start
+	shots = {frame: (rng.randint(300, 1000), rng.randint(50, 670)) for frame in range(0, steps, 40)}
+
+	timer = Timer()
+	for frame in range(steps):
+		if frame in shots:
+			game.fire(shots[frame])
+		timer.step(game, {"physics": "physics", "collisions": "collision", "trails": "trails"})
+		if window is not None:
+			timer.measure("render", render, game)
+		if game.finished():
+			break
+	entities = {"asteroids": len(game.asteroids), "rockets": len(game.rockets), "blocks": len(game.blocks)}
+	#The adaptive integrator also reports how many steps it took
+	if hasattr(game.integrator, "totals"):
+		entities["integrator"] = dict(game.integrator.totals)
+	return timer, game.frame, entities
+
+def pong_scenario(window, steps, num_balls, seed, integrator="rk4"):
+	os.chdir(PONG_DIR)
+	rng = random.Random(seed)
+	game = pong.Game(window, integrator=integrator, profile=True, seed=seed)
+	#Start from an already split field of slow balls so most stay in play
+	game.balls = [pong.Ball(game, game.FPS, rng.choice((-1, 1)) * rng.uniform(1, 3), rng.uniform(-3, 3), rng.randint(10, 20), rng.uniform(200, pong.windowWidth - 200), rng.uniform(60, pong.windowHeight - 60)) for i in range(num_balls)]
+	#Scoring would reset the field to a single ball, balls that score are
+	#dropped instead so they do not fly off forever
+	def drop_scored(player):
+		game.balls = [ball for ball in game.balls if 0 < ball.x < pong.windowWidth]
+	game.increment_score = drop_scored
+	#Both players fire continuously, which keeps splitting balls
+	keys = pong.KeyState([pygame.K_f, pygame.K_SLASH])
+
+	timer = Timer()
+	for frame in range(steps):
+		timer.step(game, {"physics": "physics", "collisions": "collision"}, keys)
+		if window is not None:
+			timer.measure("render", render, game)
+		if game.b_game_over:
+			break
+	entities = {"balls": len(game.balls), "projectiles": len(game.projectiles)}
+	if hasattr(game.integrator, "totals"):
+		entities["integrator"] = dict(game.integrator.totals)
+	return timer, game.frame, entities
+
+def render(game):
+	game.draw()
+	present(game.renderer)
+
+#name -> (function, keyword arguments, default steps). funloop_level is the
+#shipped level with its usual 7 asteroids
+SCENARIOS = {
+	"funloop_level": (funloop_scenario, {"num_asteroids": 7, "gravity_mode": "exact"}, 1000),
+	"funloop_asteroids_100": (funloop_scenario, {"num_asteroids": 100, "gravity_mode": "exact"}, 200),
+	"funloop_asteroids_1000": (funloop_scenario, {"num_asteroids": 1000, "gravity_mode": "exact", "spread": True}, 20),
+	"funloop_asteroids_10000": (funloop_scenario, {"num_asteroids": 10000, "gravity_mode": "barnes_hut", "spread": True}, 3),
+	"pong_split": (pong_scenario, {"num_balls": 64}, 500),
+}
+
+#Counters of the process-wide sprite, text and image caches
+def cache_stats():
+	return {"sprites": cache.sprites.stats(), "texts": cache.texts.stats(), "assets": assets.assets.stats()}
+
+#Counters from after minus before, sizes as they are after
+def cache_usage(before, after):
+	return {name: {key: value if key == "size" else value - before[name][key] for key, value in counters.items()} for name, counters in after.items()}
+
+def run_scenario(name, window, steps=None, seed=0, gravity_mode=None, integrator=None, static_field=False):
+	function, kwargs, default_steps = SCENARIOS[name]
+	kwargs = dict(kwargs)
+	if gravity_mode is not None and "gravity_mode" in kwargs:
+		kwargs["gravity_mode"] = gravity_mode
+	if integrator is not None:
+		kwargs["integrator"] = integrator
+	if static_field and "gravity_mode" in kwargs:
+		kwargs["static_field"] = True
+	steps = steps or default_steps
+	caches = cache_stats()
+	start = time.perf_counter()
+	timer, steps_run, entities = function(window, steps, seed=seed, **kwargs)
+	elapsed = time.perf_counter() - start
+	return {
+		"name": name,
+		"seed": seed,
+		"settings": kwargs,
+		"steps": steps_run,
+		"seconds": elapsed,
+		"steps_per_second": steps_run / elapsed if elapsed > 0 else None,
+		"phases": timer.summary(),
+		"entities": entities,
+		"caches": cache_usage(caches, cache_stats()),
+	}
+
+#Prints scenarios whose steps per second dropped by more than threshold
+def compare(results, baseline, threshold):
+	previous = {each["name"]: each for each in baseline["scenarios"]}
+	regressions = 0
+	for each in results["scenarios"]:
+		if each["name"] not in previous or not previous[each["name"]]["steps_per_second"]:
+			continue
+		ratio = each["steps_per_second"] / previous[each["name"]]["steps_per_second"]
+		flag = ""
+		if ratio < 1 - threshold:
+			flag = "  REGRESSION"
+			regressions += 1
+		print("%-26s %8.1f steps/s  x%.2f vs baseline%s" % (each["name"], each["steps_per_second"], ratio, flag))
+	return regressions
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument("--only", nargs="*", choices=sorted(SCENARIOS), help="scenarios to run (default: all)")
+	parser.add_argument("--steps", type=int, help="override the number of steps of every scenario")
+	parser.add_argument("--seed", type=int, default=0)
+	parser.add_argument("--gravity", choices=("exact", "barnes_hut"), help="gravity mode for funloop scenarios")
+	parser.add_argument("--integrator", choices=sorted(integrators.INTEGRATORS), help="integrator for every scenario (default rk4)")
+	parser.add_argument("--static-field", action="store_true", help="read the sun and black holes' pull from a lattice in funloop scenarios")
+	parser.add_argument("--no-render", action="store_true", help="run headless and skip the render phase")
+	parser.add_argument("--out", help="write JSON results here instead of stdout")
+	parser.add_argument("--compare", help="previous results to compare against")
+	parser.add_argument("--threshold", type=float, default=0.1, help="slowdown counted as a regression (default 0.1)")
+	args = parser.parse_args()
+
+	pygame.init()
+	window = None
+	if not args.no_render:
+		window = pygame.display.set_mode((funloop.windowWidth, funloop.windowHeight))
+
+	results = {
+		"meta": {
+			"python": platform.python_version(),
+			"pygame": pygame.version.ver,
+			"numpy": np.__version__,
+			"platform": platform.platform(),
+			"render": window is not None,
+		},
+		"scenarios": [],
+	}
+	cwd = os.getcwd()
+	try:
+		for name in args.only or SCENARIOS:
+			results["scenarios"].append(run_scenario(name, window, args.steps, args.seed, args.gravity, args.integrator, args.static_field))
+	finally:
+		os.chdir(cwd)
+
+	output = json.dumps(results, indent=2)
+	if args.out:
+		with open(args.out, "w") as file:
+			file.write(output + "\n")
+	else:
+		print(output)
+
+	if args.compare:
+		with open(args.compare) as file:
+			baseline = json.load(file)
+		if compare(results, baseline, args.threshold) > 0:
+			sys.exit(1)
+
+if __name__ == "__main__":
+	main()
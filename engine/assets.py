@@ -0,0 +1,86 @@
+import hashlib
+import os
+import struct
+import pygame
+
+from engine import atomic
+
+CACHE_DIR = ".asset_cache"
+#Bump when cached images would differ for the same source, so old ones are ignored
+VERSION = 1
+#magic, width, height, whether the pixels have alpha
+HEADER = struct.Struct("<4sIIB")
+MAGIC = b"ASST"
+
+class AssetManager:
+	"""Images loaded once per process, on first use.
+
+	image(path, alpha, scale) returns the file at path converted to the
+	display's pixel format (with per-pixel alpha unless alpha is False) and
+	rotozoomed by scale when one is given. Every result is kept for the life
+	of the process, so restarting a round costs nothing. Results are also
+	saved under directory as raw pixels, keyed by the source file's size and
+	modification time, so the next run skips decoding and scaling and only
+	converts the pixels."""
+	def __init__(self, directory=CACHE_DIR):
+		self.directory = directory
+		self.images = {}
+		self.hits = 0
+		self.disk_hits = 0
+		self.loads = 0
+
+	def image(self, path, alpha=True, scale=None):
+		key = (os.path.abspath(path), alpha, scale)
+		if key in self.images:
+			self.hits += 1
+			return self.images[key]
+		stat = os.stat(path)
+		digest = hashlib.sha1(repr((VERSION, key, stat.st_size, stat.st_mtime_ns)).encode()).hexdigest()[:16]
+		cached = os.path.join(self.directory, "%s-%s.raw" % (os.path.splitext(os.path.basename(path))[0], digest))
+		surface = self.read(cached)
+		if surface is None:
+			surface = self.build(path, alpha, scale)
+			self.write(cached, surface)
+		else:
+			self.disk_hits += 1
+		self.images[key] = surface
+		return surface
+
+	def build(self, path, alpha, scale):
+		self.loads += 1
+		surface = pygame.image.load(path)
+		surface = surface.convert_alpha() if alpha else surface.convert()
+		if scale is not None:
+			surface = pygame.transform.rotozoom(surface, 0, scale)
+		return surface
+
+	#The cached image at path in display format, or None when it cannot be used
+	def read(self, path):
+		try:
+			with open(path, "rb") as file:
+				data = file.read()
+			magic, width, height, alpha = HEADER.unpack_from(data)
+		except (OSError, struct.error):
+			return None
+		if magic != MAGIC or len(data) != HEADER.size + width * height * (4 if alpha else 3):
+			return None
+		surface = pygame.image.frombytes(data[HEADER.size:], (width, height), "RGBA" if alpha else "RGB")
+		return surface.convert_alpha() if alpha else surface.convert()
+
+	def write(self, path, surface):
+		alpha = bool(surface.get_flags() & pygame.SRCALPHA)
+		pixels = pygame.image.tobytes(surface, "RGBA" if alpha else "RGB")
+		atomic.write_cache(path, lambda file: file.write(HEADER.pack(MAGIC, surface.get_width(), surface.get_height(), alpha) + pixels))
+
+	#Forgets the loaded images, the next request for each reads the disk cache
+	def clear(self):
+		self.images.clear()
+
+	def stats(self):
+		return {"hits": self.hits, "disk_hits": self.disk_hits, "loads": self.loads, "size": len(self.images)}
+
+#Shared by every game in the process
+assets = AssetManager()
+
+def image(path, alpha=True, scale=None):
+	return assets.image(path, alpha, scale)
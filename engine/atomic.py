@@ -0,0 +1,31 @@
+import os
+
+#Saves a file by calling write(file) on a temporary file next to path and
+#renaming it over path in one step, so readers and crashes only ever see
+#the old file or the new one. sync also flushes it to disk before the rename
+def write_file(path, write, mode="wb", sync=False):
+	temp = path + ".tmp"
+	try:
+		with open(temp, mode) as file:
+			write(file)
+			if sync:
+				file.flush()
+				os.fsync(file.fileno())
+		os.replace(temp, path)
+	except BaseException:
+		try:
+			os.remove(temp)
+		except OSError:
+			pass
+		raise
+
+#write_file() for caches, creating the directory first. A cache that cannot
+#be saved is only built again next time, so errors are ignored. Returns
+#whether it was saved
+def write_cache(path, write, mode="wb"):
+	try:
+		os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+		write_file(path, write, mode)
+	except OSError:
+		return False
+	return True
@@ -0,0 +1,58 @@
+from collections import OrderedDict
+import pygame
+
+class LRUCache:
+	"""Bounded cache that evicts the least recently used entry once full.
+	Keeps hit/miss/eviction counters so callers can check it is working."""
+	def __init__(self, capacity=256):
+		self.capacity = capacity
+		self.entries = OrderedDict()
+		self.hits = 0
+		self.misses = 0
+		self.evictions = 0
+
+	#Returns the cached value for key, calling build() to create it on a miss
+	def get(self, key, build):
+		if key in self.entries:
+			self.hits += 1
+			self.entries.move_to_end(key)
+			return self.entries[key]
+		self.misses += 1
+		value = build()
+		self.entries[key] = value
+		if len(self.entries) > self.capacity:
+			self.entries.popitem(last=False)
+			self.evictions += 1
+		return value
+
+	def clear(self):
+		self.entries.clear()
+
+	def stats(self):
+		return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions, "size": len(self.entries)}
+
+#Transformed sprites shared by every draw method, keyed by source image and size
+sprites = LRUCache(256)
+
+def scaled(image, size):
+	size = (int(size[0]), int(size[1]))
+	return sprites.get((image, "scale", size), lambda: pygame.transform.scale(image, size))
+
+def rotozoomed(image, angle, scale):
+	return sprites.get((image, "rotozoom", angle, scale), lambda: pygame.transform.rotozoom(image, angle, scale))
+
+#Fonts loaded once per (face, size, bold), SysFont lookups hit the filesystem
+fonts = {}
+
+def font(face, size, bold=False):
+	key = (face, size, bold)
+	if key not in fonts:
+		fonts[key] = pygame.font.SysFont(face, size, bold)
+	return fonts[key]
+
+#Rendered strings, only re-rendered when the font, text or color changes
+texts = LRUCache(128)
+
+def render(font, string, color):
+	color = tuple(color)
+	return texts.get((font, string, color), lambda: font.render(string, 1, color))
@@ -0,0 +1,148 @@
+import numpy as np
+
+#Per-entity columns and their types
+COLUMNS = (("x", np.float64), ("y", np.float64), ("dx", np.float64), ("dy", np.float64), ("radius", np.float64), ("mass", np.float64), ("g", np.float64), ("kind", np.uint8))
+
+class EntityStore:
+	"""Every entity's state as one contiguous array per column (x, y, dx, dy,
+	radius, mass, g and a kind tag), so physics and collisions can work on
+	whole arrays. The first count slots are live.
+
+	Entities are known by a stable id chosen by the game. Slots are not
+	stable: removing an entity moves the last one into its slot, so look
+	slots up with slots() when they are needed instead of keeping them."""
+	def __init__(self, capacity=64):
+		self.count = 0
+		self.capacity = capacity
+		for name, dtype in COLUMNS:
+			setattr(self, name, np.zeros(capacity, dtype=dtype))
+		self.ids = np.zeros(capacity, dtype=np.int64)
+		#id -> slot
+		self.slot = {}
+
+	def __len__(self):
+		return self.count
+
+	def __contains__(self, id):
+		return id in self.slot
+
+	def grow(self):
+		self.capacity *= 2
+		for name, dtype in COLUMNS + (("ids", np.int64),):
+			array = np.zeros(self.capacity, dtype=dtype)
+			array[:self.count] = getattr(self, name)[:self.count]
+			setattr(self, name, array)
+
+	#Stores a new entity and returns its slot
+	def add(self, id, kind=0, x=0.0, y=0.0, dx=0.0, dy=0.0, radius=0.0, mass=0.0, g=0.0):
+		if id in self.slot:
+			raise ValueError("Entity %r is already stored" % (id,))
+		if self.count == self.capacity:
+			self.grow()
+		slot = self.count
+		self.x[slot], self.y[slot], self.dx[slot], self.dy[slot] = x, y, dx, dy
+		self.radius[slot], self.mass[slot], self.g[slot], self.kind[slot] = radius, mass, g, kind
+		self.ids[slot] = id
+		self.slot[id] = slot
+		self.count += 1
+		return slot
+
+	#add() for many entities of one kind. ids is a list, the other columns are
+	#arrays in the same order or one value for all of them. Returns the slots
+	def add_many(self, ids, kind=0, x=0.0, y=0.0, dx=0.0, dy=0.0, radius=0.0, mass=0.0, g=0.0):
+		taken = [id for id in ids if id in self.slot]
+		if taken:
+			raise ValueError("Entity %r is already stored" % (taken[0],))
+		if len(set(ids)) != len(ids):
+			raise ValueError("Entity ids passed to add_many repeat")
+		while self.count + len(ids) > self.capacity:
+			self.grow()
+		slots = slice(self.count, self.count + len(ids))
+		self.x[slots], self.y[slots], self.dx[slots], self.dy[slots] = x, y, dx, dy
+		self.radius[slots], self.mass[slots], self.g[slots], self.kind[slots] = radius, mass, g, kind
+		self.ids[slots] = ids
+		self.slot.update(zip(ids, range(self.count, self.count + len(ids))))
+		self.count += len(ids)
+		return np.arange(slots.start, slots.stop)
+
+	#Swap-remove: the last entity takes over the removed one's slot
+	def remove(self, id):
+		slot = self.slot.pop(id)
+		last = self.count - 1
+		if slot != last:
+			for name, dtype in COLUMNS + (("ids", np.int64),):
+				array = getattr(self, name)
+				array[slot] = array[last]
+			self.slot[int(self.ids[slot])] = slot
+		self.count = last
+
+	def clear(self):
+		self.count = 0
+		self.slot = {}
+
+	#Slots of ids, in the same order, for indexing the columns
+	def slots(self, ids):
+		return np.fromiter(map(self.slot.__getitem__, ids), dtype=np.intp, count=len(ids))
+
+def column(name):
+	def get(self):
+		return getattr(self.store, name)[self.store.slot[self.id]]
+	def set(self, value):
+		getattr(self.store, name)[self.store.slot[self.id]] = value
+	return property(get, set)
+
+class Handle:
+	"""Thin object view of one stored entity for gameplay code. Reading or
+	setting x, dx, mass and the other columns goes straight to the store, so
+	a handle holds nothing but its store and id; subclasses list anything
+	else they keep in their own __slots__."""
+	__slots__ = ("store", "id")
+
+	def __init__(self, store, id):
+		self.store = store
+		self.id = id
+
+	x = column("x")
+	y = column("y")
+	dx = column("dx")
+	dy = column("dy")
+	radius = column("radius")
+	mass = column("mass")
+	g = column("g")
+	kind = column("kind")
+
+class Handles:
+	"""Ids of stored entities that gameplay code rarely looks at one by one,
+	such as a level's blocks. Behaves like a dict of id -> handle, but a
+	handle is only made, by make(id), when one is looked up, so storing many
+	entities costs no object per entity."""
+	def __init__(self, make):
+		self.make = make
+		#Insertion ordered set of ids
+		self.ids = {}
+
+	def __len__(self):
+		return len(self.ids)
+
+	def __contains__(self, id):
+		return id in self.ids
+
+	def __iter__(self):
+		return iter(self.ids)
+
+	def __getitem__(self, id):
+		if id not in self.ids:
+			raise KeyError(id)
+		return self.make(id)
+
+	def __delitem__(self, id):
+		del self.ids[id]
+
+	def add_many(self, ids):
+		self.ids.update(dict.fromkeys(ids))
+
+	def clear(self):
+		self.ids = {}
+
+	def values(self):
+		return (self.make(id) for id in self.ids)
@@ -0,0 +1,81 @@
+import hashlib
+import os
+import numpy as np
+
+from engine import atomic
+
+#Saved lattices live here, relative to the game's working directory
+CACHE_DIR = ".field_cache"
+#Bump when what gets saved changes so old files are rebuilt
+VERSION = 1
+
+class Lattice:
+	"""Vector field stored at the nodes of a regular grid covering (0, 0) to
+	(width, height), read back with bilinear interpolation. values has shape
+	(2, rows, columns) for the x and y components."""
+	def __init__(self, width, height, spacing=4, values=None):
+		self.width = width
+		self.height = height
+		self.spacing = spacing
+		self.columns = int(np.ceil(width / float(spacing))) + 1
+		self.rows = int(np.ceil(height / float(spacing))) + 1
+		self.values = None
+		self.corners = None
+		if values is not None:
+			self.set_values(values)
+
+	#Node positions as two (rows, columns) arrays
+	def grid(self):
+		return np.meshgrid(np.arange(self.columns) * float(self.spacing), np.arange(self.rows) * float(self.spacing))
+
+	def set_values(self, values):
+		self.values = values
+		#The four corners of every cell side by side, x components then y, so
+		#a sample is a single gather
+		corners = np.stack([values[:, :-1, :-1], values[:, :-1, 1:], values[:, 1:, :-1], values[:, 1:, 1:]], axis=-1)
+		self.corners = np.ascontiguousarray(corners.transpose(1, 2, 0, 3).reshape(-1, 8))
+
+	#Stores function(x, y) -> (value_x, value_y) evaluated at every node
+	def fill(self, function):
+		x, y = self.grid()
+		value_x, value_y = function(x.ravel(), y.ravel())
+		self.set_values(np.stack([np.reshape(value_x, x.shape), np.reshape(value_y, x.shape)]))
+		return self
+
+	#Returns (value_x, value_y, cell) at each point, where cell is the flat
+	#index of the grid cell holding the point or -1 off the grid. Off-grid
+	#points get zeros so the caller can compute them some other way
+	def sample(self, x, y):
+		grid_x = np.asarray(x, dtype=float) / self.spacing
+		grid_y = np.asarray(y, dtype=float) / self.spacing
+		column = np.floor(grid_x).astype(np.intp)
+		row = np.floor(grid_y).astype(np.intp)
+		inside = (column >= 0) & (row >= 0) & (column < self.columns - 1) & (row < self.rows - 1)
+		cell = np.where(inside, row * (self.columns - 1) + column, 0)
+		across = grid_x - column
+		down = grid_y - row
+		weights = np.empty((len(cell), 4))
+		weights[:, 0] = (1 - across) * (1 - down)
+		weights[:, 1] = across * (1 - down)
+		weights[:, 2] = (1 - across) * down
+		weights[:, 3] = across * down
+		weights *= inside[:, None]
+		corners = self.corners[cell]
+		value_x = np.einsum("ij,ij->i", corners[:, :4], weights)
+		value_y = np.einsum("ij,ij->i", corners[:, 4:], weights)
+		return value_x, value_y, np.where(inside, cell, -1)
+
+#Returns the dict of arrays build() makes, reusing the copy saved under name
+#when it was built from the same key
+def cached(name, key, build, directory=CACHE_DIR):
+	digest = hashlib.sha1(repr((VERSION, key)).encode()).hexdigest()[:16]
+	path = os.path.join(directory, "%s-%s.npz" % (name, digest))
+	if os.path.exists(path):
+		try:
+			with np.load(path) as data:
+				return {each: data[each] for each in data.files}
+		except (OSError, ValueError):
+			pass
+	arrays = build()
+	atomic.write_cache(path, lambda file: np.savez(file, **arrays))
+	return arrays
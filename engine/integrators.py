@@ -0,0 +1,193 @@
+import numpy as np
+
+#Integrators shared by both games. Every integrator works on whole arrays of
+#bodies at once, is called as integrator(accel, x, y, dx, dy, keys) and
+#returns the change in (x, y, dx, dy) over one frame. accel(x, y, active)
+#returns (accel_x, accel_y) arrays for the bodies selected by active, which
+#may be left out to mean every body. keys identify the bodies between calls
+#for integrators that carry state from frame to frame.
+
+#Standard 4th order Runge-Kutta, four force evaluations per body
+def rk4(accel, x, y, dx, dy, keys=None):
+	#calculate accel at start
+	k_1_accel = accel(x, y)
+	k_1_vel = (dx, dy)
+
+	#calculate accel in the middle (k2)
+	k_2_accel = accel(x + 0.5*k_1_vel[0], y + 0.5*k_1_vel[1])
+	k_2_vel = (dx + 0.5*k_1_accel[0], dy + 0.5*k_1_accel[1])
+
+	#calculate accel in the middle (k3)
+	k_3_accel = accel(x + 0.5*k_2_vel[0], y + 0.5*k_2_vel[1])
+	k_3_vel = (dx + 0.5*k_2_accel[0], dy + 0.5*k_2_accel[1])
+
+	#calculate accel at the end
+	k_4_accel = accel(x + k_3_vel[0], y + k_3_vel[1])
+	k_4_vel = (dx + k_3_accel[0], dy + k_3_accel[1])
+
+	delta_x = (1.0/6.0) * (k_1_vel[0] + 2.0 * (k_2_vel[0] + k_3_vel[0]) + k_4_vel[0])
+	delta_y = (1.0/6.0) * (k_1_vel[1] + 2.0 * (k_2_vel[1] + k_3_vel[1]) + k_4_vel[1])
+	delta_vx = (1.0/6.0) * (k_1_accel[0] + 2.0 * (k_2_accel[0] + k_3_accel[0]) + k_4_accel[0])
+	delta_vy = (1.0/6.0) * (k_1_accel[1] + 2.0 * (k_2_accel[1] + k_3_accel[1]) + k_4_accel[1])
+	return (delta_x, delta_y, delta_vx, delta_vy)
+
+#Dormand-Prince 5(4) tableau. The forces do not depend on time so the nodes are not needed
+DP_A = [
+	[],
+	[1.0/5.0],
+	[3.0/40.0, 9.0/40.0],
+	[44.0/45.0, -56.0/15.0, 32.0/9.0],
+	[19372.0/6561.0, -25360.0/2187.0, 64448.0/6561.0, -212.0/729.0],
+	[9017.0/3168.0, -355.0/33.0, 46732.0/5247.0, 49.0/176.0, -5103.0/18656.0],
+	[35.0/384.0, 0.0, 500.0/1113.0, 125.0/192.0, -2187.0/6784.0, 11.0/84.0],
+]
+#5th order weights are the last row of DP_A, these are the embedded 4th order ones
+DP_B4 = [5179.0/57600.0, 0.0, 7571.0/16695.0, 393.0/640.0, -92097.0/339200.0, 187.0/2100.0, 1.0/40.0]
+
+class DormandPrince:
+	"""Adaptive Dormand-Prince RK45. Each body covers one frame in as many
+	sub-steps as its own error estimate needs, so bodies in empty space take
+	a single step while bodies near the sun or a black hole sub-step.
+
+	The error allowed per sub-step is atol + rtol * speed, in pixels for
+	positions and pixels per frame for velocities. stats holds the counts for the last call, totals the running sums.
+
+	The step size each body ended a frame with is kept per key, so a body in
+	a close pass starts the next frame at the step size it needed last frame.
+	The last stage of an accepted sub-step is reused as the first stage of the
+	next one within a frame only, since the attractors may have moved by the
+	next frame."""
+	def __init__(self, rtol=1e-5, atol=1e-4, max_substeps=32, min_step=1.0/256.0):
+		self.rtol = rtol
+		self.atol = atol
+		self.max_substeps = max_substeps
+		self.min_step = min_step
+		self.stats = {}
+		self.totals = {"calls": 0, "steps": 0, "rejected": 0, "evaluations": 0}
+		#key -> step size at the end of the last frame
+		self.cache = {}
+
+	def __call__(self, accel, x, y, dx, dy, keys=None):
+		state = np.array([x, y, dx, dy], dtype=float).reshape(4, -1)
+		start = state.copy()
+		count = state.shape[1]
+		time = np.zeros(count)
+		step = np.ones(count)
+		substeps = np.zeros(count, dtype=int)
+		#First stage of the next step, reused from the last stage of an accepted one
+		first = np.zeros((4, count))
+		first_valid = np.zeros(count, dtype=bool)
+		if keys is not None:
+			for i, key in enumerate(keys):
+				step[i] = self.cache.get(key, 1.0)
+		steps = rejected = evaluations = 0
+		smallest = 1.0
+
+		while True:
+			active = np.flatnonzero(time < 1.0 - 1e-12)
+			if len(active) == 0:
+				break
+			h = np.minimum(step[active], 1.0 - time[active])
+			y0 = state[:, active]
+
+			#Bodies with an accepted step reuse its last stage as their first
+			stages = [first[:, active].copy()]
+			fresh = ~first_valid[active]
+			if fresh.any():
+				stages[0][:, fresh] = self.derivative(accel, y0[:, fresh], active[fresh])
+				evaluations += int(fresh.sum())
+			for i in range(1, 7):
+				point = y0.copy()
+				for j, a in enumerate(DP_A[i]):
+					if a != 0.0:
+						point += h * a * stages[j]
+				stages.append(self.derivative(accel, point, active))
+				evaluations += len(active)
+			y5 = point
+
+			error = np.zeros_like(y0)
+			for i in range(7):
+				weight = DP_A[6][i] - DP_B4[i] if i < 6 else -DP_B4[i]
+				if weight != 0.0:
+					error += h * weight * stages[i]
+			speed = np.maximum(np.hypot(y0[2], y0[3]), np.hypot(y5[2], y5[3]))
+			tolerance = self.atol + self.rtol * speed
+			norm = np.sqrt(np.mean((error / tolerance) ** 2, axis=0))
+
+			substeps[active] += 1
+			accept = (norm <= 1.0) | (h <= self.min_step) | (substeps[active] >= self.max_substeps)
+			done = active[accept]
+			state[:, done] = y5[:, accept]
+			time[done] += h[accept]
+			first[:, done] = stages[6][:, accept]
+			first_valid[done] = True
+			steps += int(accept.sum())
+			rejected += int((~accept).sum())
+			smallest = min(smallest, float(h.min()))
+
+			#Standard step size controller for a 5th order method
+			factor = np.clip(0.9 * np.maximum(norm, 1e-10) ** -0.2, 0.2, 5.0)
+			step[active] = np.clip(h * factor, self.min_step, 1.0)
+
+		self.stats = {"bodies": count, "steps": steps, "rejected": rejected, "evaluations": evaluations, "max_substeps": int(substeps.max()) if count else 0, "min_step": smallest}
+		self.totals["calls"] += 1
+		self.totals["steps"] += steps
+		self.totals["rejected"] += rejected
+		self.totals["evaluations"] += evaluations
+		delta = state - start
+		if keys is not None:
+			#Forget bodies that are gone once the cache holds many more than are moving
+			if len(self.cache) > 2 * len(keys) + 64:
+				self.cache = {}
+			for i, key in enumerate(keys):
+				self.cache[key] = step[i]
+		return (delta[0], delta[1], delta[2], delta[3])
+
+	#Time derivative of (x, y, dx, dy) for the selected bodies
+	def derivative(self, accel, point, active):
+		accel_x, accel_y = accel(point[0], point[1], active)
+		return np.array([point[2], point[3], accel_x, accel_y])
+
+#Semi-implicit (symplectic) Euler, one force evaluation per body
+def euler(accel, x, y, dx, dy, keys=None):
+	accel_x, accel_y = accel(x, y)
+	return (dx + accel_x, dy + accel_y, accel_x, accel_y)
+
+#Velocity Verlet (kick-drift-kick leapfrog), two force evaluations per body.
+#The pull at the start of a frame is always evaluated fresh since the
+#attractors and the bodies' masses can change between frames
+def verlet(accel, x, y, dx, dy, keys=None):
+	accel_x, accel_y = accel(x, y)
+	delta_x = dx + 0.5 * accel_x
+	delta_y = dy + 0.5 * accel_y
+	end_x, end_y = accel(x + delta_x, y + delta_y)
+	return (delta_x, delta_y, 0.5 * (accel_x + end_x), 0.5 * (accel_y + end_y))
+
+#Integrators by name. Classes are created fresh for every user since they keep state
+INTEGRATORS = {
+	"rk4": rk4,
+	"rk45": DormandPrince,
+	"verlet": verlet,
+	"euler": euler,
+}
+
+#Returns the integrator called name, or integrator itself when it is already one
+def get(integrator, **options):
+	if not isinstance(integrator, str):
+		return integrator
+	if integrator not in INTEGRATORS:
+		raise ValueError("unknown integrator %r, expected one of %s" % (integrator, ", ".join(sorted(INTEGRATORS))))
+	entry = INTEGRATORS[integrator]
+	if isinstance(entry, type):
+		return entry(**options)
+	return entry
+
+#The integrator for body, a body or body class: the one named by its
+#integrator attribute when set, otherwise default. created holds the ones made
+#so far by name, so bodies naming the same integrator share it and its state
+def for_body(body, default, created):
+	if body.integrator is None:
+		return default
+	if body.integrator not in created:
+		created[body.integrator] = get(body.integrator)
+	return created[body.integrator]
@@ -0,0 +1,51 @@
+import pygame
+
+class StaticLayer:
+	"""Everything that does not move, composited once into a cached surface.
+
+	paint(surface, area) draws the static content onto surface. It is called
+	for the whole layer on first use, and afterwards only for regions passed
+	to invalidate(), with drawing clipped to the region, so removing one
+	block repaints just that block's square. Each frame then starts with a
+	single blit of the layer, or with a DirtyRenderer only the repainted
+	regions are redrawn."""
+	def __init__(self, size, paint):
+		self.size = size
+		self.paint = paint
+		self.surface = None
+		#Regions to repaint, None repaints everything
+		self.regions = None
+
+	#Marks a rect as changed, or the whole layer when rect is None
+	def invalidate(self, rect=None):
+		if rect is None or self.regions is None:
+			self.regions = None
+		else:
+			self.regions.append(pygame.Rect(rect))
+
+	#Repaints whatever changed and returns the rects repainted
+	def update(self):
+		if self.surface is None:
+			self.surface = pygame.Surface(self.size).convert()
+			self.regions = None
+		bounds = self.surface.get_rect()
+		regions = [bounds] if self.regions is None else [rect.clip(bounds) for rect in self.regions]
+		for rect in regions:
+			if rect.width > 0 and rect.height > 0:
+				self.surface.set_clip(rect)
+				self.paint(self.surface, rect)
+		self.surface.set_clip(None)
+		self.regions = []
+		return regions
+
+	#Starts a frame on surface with the layer brought up to date
+	def draw(self, surface, renderer=None):
+		regions = self.update()
+		if renderer is None:
+			surface.blit(self.surface, (0, 0))
+			return
+		if renderer.background is not self.surface:
+			renderer.set_background(self.surface)
+		for rect in regions:
+			renderer.refresh(rect)
+		renderer.begin()
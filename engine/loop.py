@@ -0,0 +1,78 @@
+import time
+from contextlib import contextmanager
+import numpy as np
+import pygame
+
+class FixedStep:
+	"""Runs a simulation at a fixed rate whatever rate it is drawn at. Each
+	drawn frame, advance() adds the real time since the last one and returns
+	how many steps of 1 / rate seconds are due; what is left over is kept for
+	later frames and alpha() is how far into the next step it reaches, for
+	drawing between the last two states.
+
+	At most max_steps are returned at once. Time beyond that is dropped, so a
+	machine too slow to keep up runs the game slower instead of falling
+	further behind every frame."""
+	def __init__(self, rate, max_steps=5, clock=time.perf_counter):
+		self.step = 1.0 / rate
+		self.max_steps = max_steps
+		self.clock = clock
+		self.accumulator = 0.0
+		self.last = None
+
+	def advance(self):
+		now = self.clock()
+		if self.last is not None:
+			self.accumulator += now - self.last
+		self.last = now
+		steps = int(self.accumulator / self.step)
+		if steps > self.max_steps:
+			steps = self.max_steps
+			self.accumulator %= self.step
+		else:
+			self.accumulator -= steps * self.step
+		return steps
+
+	#Fraction of a step between the last state and the next one
+	def alpha(self):
+		return min(self.accumulator / self.step, 1.0)
+
+	#Forgets the time since the last frame, for after a pause
+	def reset(self):
+		self.accumulator = 0.0
+		self.last = None
+
+#Shows a drawn frame, only the rects renderer marked when it is a
+#DirtyRenderer, otherwise the whole window
+def present(renderer=None):
+	if renderer is None:
+		pygame.display.flip()
+	else:
+		renderer.present()
+
+#Positions alpha of the way from previous to current. ids and previous_ids
+#name the rows of each, rows with no previous position stay where they are
+def interpolate(previous_ids, previous, ids, current, alpha):
+	order = np.argsort(previous_ids, kind="stable")
+	index = np.searchsorted(previous_ids[order], ids)
+	index[index == len(order)] = 0
+	found = np.zeros(len(ids), dtype=bool)
+	if len(order) > 0:
+		index = order[index]
+		found = previous_ids[index] == ids
+	drawn = current.copy()
+	drawn[found] = previous[index[found]] + alpha * (current[found] - previous[index[found]])
+	return drawn
+
+#Sets attributes for the length of a with block and puts the old values
+#back afterwards. changes are (object, name, value)
+@contextmanager
+def swapped(changes):
+	old = [(each, name, getattr(each, name)) for each, name, value in changes]
+	for each, name, value in changes:
+		setattr(each, name, value)
+	try:
+		yield
+	finally:
+		for each, name, value in reversed(old):
+			setattr(each, name, value)
@@ -0,0 +1,66 @@
+import queue
+import threading
+
+class Pipeline:
+	"""Runs a simulation on a worker thread one frame ahead of drawing.
+
+	There are two snapshot buffers. submit(job) has the worker call
+	advance(job, back), which moves the simulation on and writes what to
+	draw into the back buffer, while the caller draws the front one. swap()
+	waits for the worker and exchanges the buffers, so a buffer is never
+	written while it is being drawn. Between submit() and swap() only the
+	worker may touch the simulation.
+
+	Use it in a with block, or call close(), to stop the worker."""
+	def __init__(self, advance, front, back):
+		self.advance = advance
+		self.front = front
+		self.back = back
+		self.busy = False
+		self.jobs = queue.Queue(1)
+		self.done = queue.Queue(1)
+		self.thread = threading.Thread(target=self.work, daemon=True)
+		self.thread.start()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args):
+		self.close()
+
+	def work(self):
+		while True:
+			job = self.jobs.get()
+			if job is None:
+				return
+			try:
+				self.advance(job, self.back)
+				self.done.put(None)
+			except BaseException as error:
+				self.done.put(error)
+
+	def submit(self, job):
+		if self.busy:
+			raise RuntimeError("swap() the last job in before submitting another")
+		self.busy = True
+		self.jobs.put(job)
+
+	#Waits for the submitted job, makes the buffer it wrote the front one and
+	#returns it. Errors raised on the worker are raised again here
+	def swap(self):
+		if self.busy:
+			self.busy = False
+			error = self.done.get()
+			if error is not None:
+				raise error
+		self.front, self.back = self.back, self.front
+		return self.front
+
+	#Waits for any job still running, without raising its errors, and stops the worker
+	def close(self):
+		if self.busy:
+			self.busy = False
+			self.done.get()
+		if self.thread.is_alive():
+			self.jobs.put(None)
+			self.thread.join()
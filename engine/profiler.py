@@ -0,0 +1,137 @@
+import csv
+import json
+import threading
+import time
+from collections import deque
+import numpy as np
+import pygame
+
+from engine import cache
+
+class Profiler:
+	"""Times each phase of a frame. A frame is start(), then lap(phase) after
+	each phase, which charges the time since the previous lap to that phase,
+	then end(**counts) with entity counts for the record.
+
+	The last history frames of every phase are kept for the overlay and
+	histogram(), and up to max_records per-frame records for export().
+	While disabled every call returns straight away. Laps from threads other
+	than the one that started the frame, such as a physics worker, are
+	ignored."""
+	def __init__(self, enabled=False, history=240, max_records=100000):
+		self.enabled = enabled
+		self.history = history
+		self.visible = False
+		self.phases = {}
+		self.records = deque(maxlen=max_records)
+		self.frames = 0
+		self.last = 0
+		self.frame_start = 0
+		self.current = {}
+		self.counts = {}
+		self.thread = None
+		self.overlay = None
+		self.overlay_frame = -1
+
+	def toggle(self):
+		self.enabled = not self.enabled
+		self.last = 0
+
+	#Shows or hides the overlay, turning the profiler on with it
+	def toggle_overlay(self):
+		self.visible = not self.visible
+		if self.visible and not self.enabled:
+			self.toggle()
+
+	def start(self):
+		if not self.enabled:
+			return
+		self.frame_start = self.last = time.perf_counter_ns()
+		self.current = {}
+		self.thread = threading.get_ident()
+
+	def lap(self, phase):
+		if not self.enabled or self.last == 0 or threading.get_ident() != self.thread:
+			return
+		now = time.perf_counter_ns()
+		self.current[phase] = self.current.get(phase, 0) + now - self.last
+		self.last = now
+
+	def end(self, **counts):
+		if not self.enabled or self.last == 0:
+			return
+		index = self.frames % self.history
+		for phase, elapsed in self.current.items():
+			if phase not in self.phases:
+				self.phases[phase] = np.zeros(self.history)
+		for phase, samples in self.phases.items():
+			samples[index] = self.current.get(phase, 0) / 1e6
+		total = (self.last - self.frame_start) / 1e6
+		record = {"frame": self.frames, "total_ms": total}
+		for phase, elapsed in self.current.items():
+			record[phase + "_ms"] = elapsed / 1e6
+		record.update(counts)
+		self.records.append(record)
+		self.counts = counts
+		self.frames += 1
+
+	#Milliseconds of each phase over the frames in the window
+	def window(self):
+		size = min(self.frames, self.history)
+		return {phase: samples[:size] for phase, samples in self.phases.items()}
+
+	#Counts of recent frames per bin of phase time in milliseconds
+	def histogram(self, phase, bins=(0, 0.25, 0.5, 1, 2, 4, 8, 16, 33, 66, np.inf)):
+		samples = self.window().get(phase, np.zeros(0))
+		counts, edges = np.histogram(samples, bins=bins)
+		return counts, edges
+
+	#Writes every kept record, as JSON when path ends in .json and CSV otherwise.
+	#With no records, such as when profiling never ran, nothing is written so
+	#an earlier export is kept. Returns whether the file was written
+	def export(self, path):
+		records = list(self.records)
+		if not records:
+			print("No profile records to export to %s, start with --profile or press F3" % path)
+			return False
+		if path.endswith(".json"):
+			with open(path, "w") as file:
+				json.dump({"phases": list(self.phases), "records": records}, file, indent=1)
+			return True
+		fields = []
+		for record in records:
+			for key in record:
+				if key not in fields:
+					fields.append(key)
+		with open(path, "w", newline="") as file:
+			writer = csv.DictWriter(file, fields, restval=0)
+			writer.writeheader()
+			writer.writerows(records)
+		return True
+
+	#Text lines for the overlay: fps, mean and worst ms per phase, counts
+	def lines(self):
+		window = self.window()
+		total = sum(samples for samples in window.values()) if window else np.zeros(1)
+		mean_total = float(np.mean(total)) if len(total) else 0.0
+		lines = ["fps %5.1f  frame %6.2f ms" % (1000.0 / mean_total if mean_total > 0 else 0.0, mean_total)]
+		for phase, samples in window.items():
+			lines.append("%-10s %6.2f %6.2f" % (phase, samples.mean(), samples.max()))
+		lines.append("  ".join("%s %d" % (name, count) for name, count in self.counts.items()))
+		return lines
+
+	#Draws the overlay in the top left corner and returns its rect, or None
+	#when hidden. The text is only re-rendered a few times a second
+	def draw(self, surface, every=15):
+		if not self.visible or self.frames == 0:
+			return None
+		if self.overlay is None or self.frames - self.overlay_frame >= every:
+			font = cache.font("Courier", 14, True)
+			lines = self.lines()
+			height = font.get_linesize()
+			self.overlay = pygame.Surface((max(font.size(line)[0] for line in lines) + 8, height * len(lines) + 8), pygame.SRCALPHA)
+			self.overlay.fill((0, 0, 0, 170))
+			for i, line in enumerate(lines):
+				self.overlay.blit(font.render(line, 1, (230, 230, 120)), (4, 4 + i * height))
+			self.overlay_frame = self.frames
+		return surface.blit(self.overlay, (8, 8))
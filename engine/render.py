@@ -0,0 +1,59 @@
+import pygame
+
+class DirtyRenderer:
+	"""Redraws only what moved. Each frame the regions drawn last frame are
+	restored from a cached background, the caller draws its sprites and marks
+	their rects, and only the old and new rects are sent to the display.
+	Falls back to a full flip when the dirty area is more than max_fraction
+	of the screen or the background was replaced."""
+	def __init__(self, surface, background, max_fraction=0.5):
+		self.surface = surface
+		self.background = background
+		self.max_fraction = max_fraction
+		self.bounds = surface.get_rect()
+		self.previous = []
+		self.current = []
+		#Regions of the background that changed since the last frame
+		self.stale = []
+		self.full = True
+
+	def set_background(self, background):
+		self.background = background
+		self.full = True
+
+	#Forces the next frame to repaint and present the whole screen
+	def invalidate(self):
+		self.full = True
+
+	#Marks a region of the background that changed, the next frame restores
+	#and presents it
+	def refresh(self, rect):
+		rect = pygame.Rect(rect).clip(self.bounds)
+		if rect.width > 0 and rect.height > 0:
+			self.stale.append(rect)
+
+	def begin(self):
+		if self.full:
+			self.surface.blit(self.background, (0, 0))
+		else:
+			for rect in self.previous + self.stale:
+				self.surface.blit(self.background, rect, rect)
+
+	def mark(self, rect):
+		if rect is None:
+			return
+		rect = pygame.Rect(rect).clip(self.bounds)
+		if rect.width > 0 and rect.height > 0:
+			self.current.append(rect)
+
+	def present(self):
+		rects = self.previous + self.current + self.stale
+		area = sum(rect.width * rect.height for rect in rects)
+		if self.full or area > self.max_fraction * self.bounds.width * self.bounds.height:
+			pygame.display.flip()
+		else:
+			pygame.display.update(rects)
+		self.previous = self.current
+		self.current = []
+		self.stale = []
+		self.full = False
@@ -0,0 +1,127 @@
+import os
+import struct
+import time
+
+import pygame
+
+#Replay files are a header followed by fixed-size events:
+#  header: magic, version, game name, RNG seed, frames per second
+#  event:  frame, kind, two signed 16 bit values
+#Only changes are stored, so a whole game is usually a few kilobytes.
+MAGIC = b"GRPL"
+VERSION = 1
+HEADER = struct.Struct("<4sB15sQH")
+EVENT = struct.Struct("<IBhh")
+
+#Frames a replay without an end marker is played for at most
+MAX_FRAMES = 1000000
+
+#Event kinds
+END = 0
+KEYS = 1
+CLICK = 2
+
+#Packs the held keys out of key_list into a bitmask
+def encode_keys(keys, key_list):
+	mask = 0
+	for bit, key in enumerate(key_list):
+		if keys[key]:
+			mask |= 1 << bit
+	return mask
+
+def decode_keys(mask, key_list):
+	return [key for bit, key in enumerate(key_list) if mask & (1 << bit)]
+
+#Where round number of a game recorded to path goes. The first round keeps
+#path, later ones get the round number added: game.rpl, game-2.rpl, ...
+def round_path(path, number):
+	if number <= 1:
+		return path
+	base, extension = os.path.splitext(path)
+	return "%s-%d%s" % (base, number, extension)
+
+#Value following flag on the command line, or None
+def option(argv, flag):
+	if flag in argv and argv.index(flag) + 1 < len(argv):
+		return argv[argv.index(flag) + 1]
+	return None
+
+class Recorder:
+	"""Streams a game's inputs to path as they happen, so a game that is quit
+	part way still leaves a playable file. close() marks the last frame."""
+	def __init__(self, path, game, seed, fps):
+		self.file = open(path, "wb")
+		self.file.write(HEADER.pack(MAGIC, VERSION, game.encode(), seed, fps))
+		self.last_keys = None
+
+	def event(self, frame, kind, a=0, b=0):
+		self.file.write(EVENT.pack(frame, kind, a, b))
+		self.file.flush()
+
+	#Records the key bitmask for frame when it differs from the last one
+	def keys(self, frame, mask):
+		if mask != self.last_keys:
+			self.event(frame, KEYS, mask)
+			self.last_keys = mask
+
+	def click(self, frame, position):
+		self.event(frame, CLICK, int(position[0]), int(position[1]))
+
+	def close(self, frame):
+		if not self.file.closed:
+			self.event(frame, END)
+			self.file.close()
+
+class Replay:
+	"""A recorded game read back from a file. length is the number of frames
+	played, or None when the recording was cut off before close()."""
+	def __init__(self, game, seed, fps, events):
+		self.game = game
+		self.seed = seed
+		self.fps = fps
+		self.events = events
+		self.length = None
+		for frame, kind, a, b in events:
+			if kind == END:
+				self.length = frame
+
+	@classmethod
+	def load(cls, path):
+		with open(path, "rb") as file:
+			data = file.read()
+		magic, version, game, seed, fps = HEADER.unpack_from(data)
+		if magic != MAGIC or version != VERSION:
+			raise ValueError(path + " is not a replay file")
+		body = data[HEADER.size:]
+		#A recording cut off mid-write ends in a partial event, which is dropped
+		body = body[:len(body) - len(body) % EVENT.size]
+		events = list(EVENT.iter_unpack(body))
+		return cls(game.rstrip(b"\0").decode(), seed, fps, events)
+
+	#Frames to play back, after checking the replay was recorded by game
+	def frames(self, game):
+		if self.game != game:
+			raise ValueError("this is a %s replay, not a %s one" % (self.game, game))
+		return self.length or MAX_FRAMES
+
+	#Frame -> key bitmask, for the frames where the held keys changed
+	def keys(self):
+		return {frame: a for frame, kind, a, b in self.events if kind == KEYS}
+
+	#Frame -> (x, y) of the click on that frame
+	def clicks(self):
+		return {frame: (a, b) for frame, kind, a, b in self.events if kind == CLICK}
+
+#Plays back the replay at path on new_game(window, seed), in a window of size
+#captioned caption when realtime. Returns the game, what its play() returned
+#and the seconds it took
+def play_file(path, new_game, realtime, size, caption):
+	log = Replay.load(path)
+	window = None
+	if realtime:
+		window = pygame.display.set_mode(size)
+		pygame.display.set_caption(caption)
+	game = new_game(window, log.seed)
+	start = time.perf_counter()
+	result = game.play(log, window is not None)
+	return game, result, time.perf_counter() - start
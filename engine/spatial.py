@@ -0,0 +1,151 @@
+from collections import defaultdict
+import numpy as np
+
+class SpatialHash:
+	"""Uniform grid broad phase. Entries are (kind, key) with a rect
+	(x, y, width, height) like every rect() in the games; an entry is stored in
+	every cell its rect touches, edges included, so rects that only touch
+	still share a cell."""
+	def __init__(self, cell_size=64):
+		self.cell_size = cell_size
+		self.cells = defaultdict(lambda: defaultdict(list))
+
+	def clear(self):
+		self.cells.clear()
+
+	#Stores many (kind, key) entries at once, rects given as an (n, 4) array
+	#in the same order
+	def insert_many(self, entries, rects):
+		cells = self.cells
+		for (kind, key), (left, top, right, bottom) in zip(entries, cell_ranges(rects, self.cell_size).tolist()):
+			for i in range(left, right + 1):
+				for j in range(top, bottom + 1):
+					cells[(i, j)][kind].append(key)
+
+	#Keys of kind in each of the cells at positions, one list per position
+	def lookup(self, kind, positions):
+		return [self.cells[position][kind] if position in self.cells and kind in self.cells[position] else () for position in positions]
+
+	#Candidate (key_a, key_b) pairs sharing a cell, sorted so they come out in
+	#the same order as a nested loop over two id-ordered dicts. kind_b entries
+	#are looked up in other when given, a StaticGrid with the same cell size
+	def pairs(self, kind_a, kind_b, other=None):
+		other = self if other is None else other
+		cells = [(position, cell[kind_a]) for position, cell in self.cells.items() if kind_a in cell]
+		found = set()
+		for (position, keys_a), keys_b in zip(cells, other.lookup(kind_b, [position for position, keys in cells])):
+			for a in keys_a:
+				for b in keys_b:
+					if a != b:
+						found.add((a, b))
+		return sorted(found)
+
+class StaticGrid:
+	"""The same grid for entries that do not move, built once and kept from
+	frame to frame. Each kind's entries are stored as one array of cell codes
+	sorted with numpy, so indexing hundreds of thousands of blocks takes a few
+	array operations instead of a dict entry per cell. Removed entries are
+	skipped by lookup() and dropped from the arrays once they add up to half
+	of them."""
+	def __init__(self, cell_size=64):
+		self.cell_size = cell_size
+		#kind -> (sorted cell codes, key of each)
+		self.kinds = {}
+		#kind -> keys removed but still in the arrays
+		self.removed = {}
+
+	def clear(self):
+		self.kinds = {}
+		self.removed = {}
+
+	def insert_many(self, entries, rects):
+		ranges = cell_ranges(rects, self.cell_size)
+		kinds = np.array([kind for kind, key in entries], dtype=object)
+		keys = np.array([key for kind, key in entries])
+		#One (cell, entry) row for every cell an entry covers
+		columns, rows, index = [], [], []
+		for i in range(int((ranges[:, 2] - ranges[:, 0]).max(initial=0)) + 1):
+			for j in range(int((ranges[:, 3] - ranges[:, 1]).max(initial=0)) + 1):
+				covers = np.flatnonzero((ranges[:, 0] + i <= ranges[:, 2]) & (ranges[:, 1] + j <= ranges[:, 3]))
+				columns.append(ranges[covers, 0] + i)
+				rows.append(ranges[covers, 1] + j)
+				index.append(covers)
+		index = np.concatenate(index) if index else np.zeros(0, dtype=np.intp)
+		codes = cell_codes(np.concatenate(columns), np.concatenate(rows)) if index.size else np.zeros(0, dtype=np.int64)
+		for kind in set(kinds.tolist()):
+			mine = kinds[index] == kind
+			old_codes, old_keys = self.kinds.get(kind, (np.zeros(0, dtype=np.int64), keys[:0]))
+			kind_codes = np.concatenate([old_codes, codes[mine]])
+			kind_keys = np.concatenate([old_keys, keys[index[mine]]])
+			order = np.argsort(kind_codes, kind="stable")
+			self.kinds[kind] = (kind_codes[order], kind_keys[order])
+
+	#Takes (kind, key) entries out
+	def remove_many(self, entries):
+		for kind, key in entries:
+			removed = self.removed.setdefault(kind, set())
+			removed.add(key)
+			codes, keys = self.kinds[kind]
+			if len(removed) * 2 >= len(codes):
+				keep = ~np.isin(keys, list(removed))
+				self.kinds[kind] = (codes[keep], keys[keep])
+				removed.clear()
+
+	def lookup(self, kind, positions):
+		if kind not in self.kinds or len(positions) == 0:
+			return [()] * len(positions)
+		codes, keys = self.kinds[kind]
+		columns, rows = np.array(positions, dtype=np.int64).reshape(-1, 2).T
+		wanted = cell_codes(columns, rows)
+		starts = np.searchsorted(codes, wanted, "left").tolist()
+		ends = np.searchsorted(codes, wanted, "right").tolist()
+		removed = self.removed.get(kind, ())
+		return [[key for key in keys[start:end].tolist() if key not in removed] for start, end in zip(starts, ends)]
+
+#(left, top, right, bottom) cells covered by each rect of an (n, 4) array
+def cell_ranges(rects, cell_size):
+	rects = np.asarray(rects, dtype=float).reshape(-1, 4)
+	ranges = np.stack([rects[:, 0], rects[:, 1], rects[:, 0] + rects[:, 2], rects[:, 1] + rects[:, 3]], axis=1) // cell_size
+	return ranges.astype(np.int64)
+
+#One sortable number per cell, for cells within 2 ** 31 of the origin
+def cell_codes(columns, rows):
+	return (np.asarray(columns, dtype=np.int64) << 32) + (np.asarray(rows, dtype=np.int64) + (1 << 31))
+
+#Collision batches with fewer rect pairs than this are tested pair by pair,
+#numpy only pays for itself on larger ones
+VECTOR_PAIRS = 64
+
+#The games' check_collisions on whole arrays of rects, the last axis being
+#x, y, width, height. Rects overlapping or touching on both axes collide, so
+#for rects with no negative sizes the order of the two does not matter
+def rects_collide(rect1, rect2):
+	x1, y1, width1, height1 = rect1[..., 0], rect1[..., 1], rect1[..., 2], rect1[..., 3]
+	x2, y2, width2, height2 = rect2[..., 0], rect2[..., 1], rect2[..., 2], rect2[..., 3]
+	overlap_x = ((x1 >= x2) & (x1 <= x2 + width2)) | ((x1 <= x2) & (x1 + width1 >= x2))
+	overlap_y = ((y1 >= y2) & (y1 <= y2 + height2)) | ((y1 <= y2) & (y1 + height1 >= y2))
+	return overlap_x & overlap_y
+
+#Time of impact of rect moving by (dx, dy) over one step against a still
+#target, both (x, y, width, height). Returns (time, axis), time running from
+#0 at the start of the step to 1 at its end and axis 0 when rect hits a left
+#or right side of target, 1 for the top or bottom. None when they do not
+#meet during the step. Touching counts, like check_collisions
+def sweep(rect, dx, dy, target):
+	entries, exits = [], []
+	for start, size, delta, near, far in ((rect[0], rect[2], dx, target[0], target[0] + target[2]), (rect[1], rect[3], dy, target[1], target[1] + target[3])):
+		if delta == 0:
+			if start > far or start + size < near:
+				return None
+			entries.append(-float("inf"))
+			exits.append(float("inf"))
+		elif delta > 0:
+			entries.append((near - (start + size)) / delta)
+			exits.append((far - start) / delta)
+		else:
+			entries.append((far - start) / delta)
+			exits.append((near - (start + size)) / delta)
+	time, leave = max(entries), min(exits)
+	if time > leave or time > 1 or leave < 0:
+		return None
+	return max(time, 0.0), 0 if entries[0] >= entries[1] else 1
@@ -1,17 +1,39 @@
 import pygame
 import time
 from pygame import gfxdraw
-from collections import deque
 import sys
+import os
 import random
 import math
+import numpy as np
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from engine import integrators
+from engine import cache
+from engine import assets
+from engine.render import DirtyRenderer
+from engine.layers import StaticLayer
+from engine.profiler import Profiler
+from engine.spatial import VECTOR_PAIRS, rects_collide, sweep
+from engine import replay
+from engine.loop import FixedStep, present, swapped
 
 windowHeight = 720
 windowWidth = 1080
-window = pygame.display.set_mode((windowWidth, windowHeight), pygame.FULLSCREEN)
-pygame.display.set_caption("Gravity Pong")
 pygame.font.init()
 
+#Stands in for pygame.key.get_pressed() when the game is driven programmatically
+class KeyState:
+	def __init__(self, pressed=()):
+		self.pressed = set(pressed)
+
+	def __getitem__(self, key):
+		return key in self.pressed
+
+#Every key Paddle.action reads, in the order replays store them
+PADDLE_KEYS = (pygame.K_UP, pygame.K_DOWN, pygame.K_SLASH, pygame.K_w, pygame.K_s, pygame.K_f)
+#Game name in the header of pong's replay files
+REPLAY_NAME = "pong"
+
 class Paddle:
 	def __init__(self, game, direction=1): #direction 1 for left, 2 for right side
 		self.game = game
@@ -19,9 +41,9 @@ class Paddle:
 		self.paddleSpeed = 10
 		self.paddleWidth, self.paddleHeight = 10, 100
 		self.direction = direction
-		self.font = pygame.font.SysFont("Courier", 64, True)
+		self.font = cache.font("Courier", 64, True)
 		self.delay = 300
-		self.lastShot = pygame.time.get_ticks() - 10
+		self.lastShot = self.game.get_ticks() - 10
 
 		if self.direction == 2:
 			self.x, self.y = windowWidth - 20, windowHeight // 2 - self.paddleHeight // 2
@@ -30,9 +52,11 @@ class Paddle:
 
 		self.blink_colors = [(242, 228, 200), (245, 235, 215), (248, 240, 230), (252, 248, 243), (255, 255, 255)]
 		self.color_index = 0
+		#Where the paddle was at the start of the frame, for swept collisions
+		self.prev_y = self.y
 
-	def action(self):
-		keys = pygame.key.get_pressed()
+	def action(self, keys):
+		self.prev_y = self.y
 		if self.direction == 2:
 			#Move right paddle Up/Down
 			if keys[pygame.K_UP]: 
@@ -42,9 +66,9 @@ class Paddle:
 
 			#Fire projectile
 			elif keys[pygame.K_SLASH]:
-				if pygame.time.get_ticks() - self.lastShot >= self.delay:
+				if self.game.get_ticks() - self.lastShot >= self.delay:
 					self.game.generate_projectile(self.x, self.y + self.paddleHeight // 2, -1)
-					self.lastShot = pygame.time.get_ticks()
+					self.lastShot = self.game.get_ticks()
 
 		else:
 			#Move left paddle Up/Down
@@ -55,9 +79,9 @@ class Paddle:
 
 			#Fire projectile
 			elif keys[pygame.K_f]:
-				if pygame.time.get_ticks() - self.lastShot >= self.delay:
+				if self.game.get_ticks() - self.lastShot >= self.delay:
 					self.game.generate_projectile(self.x, self.y + self.paddleHeight // 2, 1)
-					self.lastShot = pygame.time.get_ticks()
+					self.lastShot = self.game.get_ticks()
 
 		#Ensures paddle does not leave window
 		if self.y < 4 + self.game.boundary_width:
@@ -76,10 +100,13 @@ class Paddle:
 			xLocationEllipse = x
 
 		#Draw the different parts of the paddle
-		pygame.gfxdraw.box(window, (x, y, width, height), color)
-		pygame.gfxdraw.box(window, (xLocationRect + width // 2, y - 4 + height // 2, 15, 8), color)
-		pygame.gfxdraw.aaellipse(window, xLocationEllipse, y + height // 2, 5, 8, color)
-		pygame.gfxdraw.filled_ellipse(window, xLocationEllipse, y + height // 2, 5, 8, color)
+		pygame.gfxdraw.box(self.game.window, (x, y, width, height), color)
+		pygame.gfxdraw.box(self.game.window, (xLocationRect + width // 2, y - 4 + height // 2, 15, 8), color)
+		pygame.gfxdraw.aaellipse(self.game.window, xLocationEllipse, y + height // 2, 5, 8, color)
+		pygame.gfxdraw.filled_ellipse(self.game.window, xLocationEllipse, y + height // 2, 5, 8, color)
+
+		#Area covered by all the parts, for dirty rect rendering
+		return pygame.Rect(x, y, width, height).union((xLocationRect + width // 2, y - 4 + height // 2, 15, 8)).union((xLocationEllipse - 5, y + height // 2 - 8, 11, 17))
 
 	def rect(self):
 		return (self.x, self.y, self.paddleWidth + 2, self.paddleHeight + 1)
@@ -118,6 +145,9 @@ class Paddle:
 			
 
 class Ball:
+	#Integrator name for balls, None uses the game's
+	integrator = None
+
 	def __init__(self, game, FPS, xSpeed, ySpeed, size=20, x=windowWidth//2, y=windowHeight//2):
 		self.x, self.y = x, y
 		self.xSpeed, self.ySpeed = xSpeed, ySpeed
@@ -127,21 +157,17 @@ class Ball:
 		self.max_speed = FPS
 		self.projectile_speed_increase = 10
 		self.ball_boundary_collision_check = [False, False, False, False, False, False]
-		self.prev_position = self.x
+		#Position at the start of the frame, for swept collisions
+		self.prev_position = (self.x, self.y)
 
 		#Gravity modifier
 		self.g = 7000
 
 	#Handles movement to account for gravity
 	def move(self):
-		delta_args = self.runge_kutta()
-		self.x = self.x + delta_args[0]
-		self.y = self.y + delta_args[1]
-		self.xSpeed = self.xSpeed + delta_args[2]
-		self.ySpeed = self.ySpeed + delta_args[3]
-
-		
+		self.game.move_balls([self])
 
+	def check_score(self):
 		if self.x <= 0:
 			self.game.increment_score(1)
 		elif self.x >= windowWidth:
@@ -149,54 +175,11 @@ class Ball:
 
 	def draw(self):
 		#Scales the asteroid image to size of the ball
-		asteroid = pygame.transform.scale(self.game.asteroid, (self.size * 2, self.size*2))
-		pygame.gfxdraw.filled_circle(window, int(self.x), int(self.y), self.size, self.color)
-		window.blit(asteroid, (self.x - self.size, self.y - self.size))
-
-
-	#Standard 4th order Runge-Kutta
-	def runge_kutta(self):
-		#calculate acceleration at start
-		k_1_accel = self.calc_accel(self.x, self.y)
-		k_1_vel = (self.xSpeed, self.ySpeed)
-
-
-		#calculate accel in the middle (k2)
-		mid_coordinates = (self.x + 0.5*k_1_vel[0], self.y + 0.5*k_1_vel[1])
-		k_2_accel = self.calc_accel(mid_coordinates[0], mid_coordinates[1])
-		k_2_vel = (self.xSpeed + 0.5*k_1_accel[0], self.ySpeed + 0.5*k_1_accel[1])
-
-		#calculate accel in the middle (k3)
-		mid_coordinates_k3 = (self.x + 0.5*k_2_vel[0], self.y + 0.5*k_2_vel[1])
-		k_3_accel = self.calc_accel(mid_coordinates_k3[0], mid_coordinates_k3[1])
-		k_3_vel = (self.xSpeed + 0.5*k_2_accel[0], self.ySpeed + 0.5*k_2_accel[1])
-
-		#calculate accel in the middle
-		end_coordinates = (self.x + k_3_vel[0], self.y + k_3_vel[1])
-		k_4_accel = self.calc_accel(end_coordinates[0], end_coordinates[1])
-		k_4_vel = (self.xSpeed + k_3_accel[0], self.ySpeed + k_3_accel[1])
-
-		delta_x = (1.0/6.0) * (k_1_vel[0] + 2.0 * (k_2_vel[0] + k_3_vel[0]) + k_4_vel[0])
-		delta_y = (1.0/6.0) * (k_1_vel[1] + 2.0 * (k_2_vel[1] + k_3_vel[1]) + k_4_vel[1])
-		delta_vx = (1.0/6.0) * (k_1_accel[0] + 2.0 * (k_2_accel[0] + k_3_accel[0]) + k_4_accel[0])
-		delta_vy = (1.0/6.0) * (k_1_accel[1] + 2.0 * (k_2_accel[1] + k_3_accel[1]) + k_4_accel[1])
-
-		#calculate accel 
-		return (delta_x, delta_y, delta_vx, delta_vy)
-
-	#Determine acceleration based on position of the ball
-	def calc_accel(self, x, y):
-		distance_left = (x + 80) ** 2 + ((y - windowHeight // 2) ** 2)
-		distance_right = (windowWidth - x + 80) ** 2 + (y - windowWidth // 2) ** 2
-		delta_force_left = (1 / distance_left) * self.g
-		delta_force_right = (1 / distance_right) * self.g
-		magnitude_left = math.sqrt(distance_left)
-		magnitude_right = math.sqrt(distance_right)
-		straight_line_vector_left = ((- 20 - x) / magnitude_left, (windowHeight // 2 - y) / magnitude_left)
-		straight_line_vector_right = ((windowWidth + 20 - x) / magnitude_right, (windowHeight // 2 - y) / magnitude_right) 
-		accel_x = straight_line_vector_left[0] * delta_force_left + straight_line_vector_right[0] * delta_force_right
-		accel_y = straight_line_vector_left[1] * delta_force_left + straight_line_vector_right[1] * delta_force_right
-		return accel_x, accel_y
+		asteroid = cache.scaled(self.game.asteroid, (self.size * 2, self.size*2))
+		pygame.gfxdraw.filled_circle(self.game.window, int(self.x), int(self.y), self.size, self.color)
+		rect = self.game.window.blit(asteroid, (self.x - self.size, self.y - self.size))
+		return rect.union((int(self.x) - self.size, int(self.y) - self.size, self.size * 2 + 1, self.size * 2 + 1))
+
 
 	def rect(self):
 		return (self.x - self.size, self.y - self.size, self.size * 2, self.size * 2)
@@ -212,50 +195,120 @@ class Ball:
 		else:
 			self.xSpeed = self.max_speed 
 
-class Projectile:
-	def __init__(self, game, x, y, val, direction=1):
-		self.x, self.y = x, y
+#Determine acceleration from the wells behind both paddles, for arrays of positions
+def calc_accel(x, y, g):
+	distance_left = (x + 80) ** 2 + ((y - windowHeight // 2) ** 2)
+	distance_right = (windowWidth - x + 80) ** 2 + (y - windowWidth // 2) ** 2
+	delta_force_left = (1 / distance_left) * g
+	delta_force_right = (1 / distance_right) * g
+	magnitude_left = np.sqrt(distance_left)
+	magnitude_right = np.sqrt(distance_right)
+	straight_line_vector_left = ((- 20 - x) / magnitude_left, (windowHeight // 2 - y) / magnitude_left)
+	straight_line_vector_right = ((windowWidth + 20 - x) / magnitude_right, (windowHeight // 2 - y) / magnitude_right) 
+	accel_x = straight_line_vector_left[0] * delta_force_left + straight_line_vector_right[0] * delta_force_right
+	accel_y = straight_line_vector_left[1] * delta_force_left + straight_line_vector_right[1] * delta_force_right
+	return accel_x, accel_y
+
+class Projectiles:
+	"""Every projectile in flight, in arrays allocated up front and kept in
+	firing order. Firing writes into the next free slot and removal compacts
+	the arrays, so shots never allocate objects; the arrays only grow when a
+	volley outnumbers them."""
+	def __init__(self, game, capacity=64):
 		self.game = game
 		self.projectileWidth, self.projectileHeight = 15, 6
-		self.direction = direction
-
-		#speed of projectile in x-direction
+		#speed of projectiles in x-direction
 		self.speed = 15
-		self.value = val
-
+		self.count = 0
+		self.x = np.zeros(capacity)
+		self.y = np.zeros(capacity)
+		self.direction = np.zeros(capacity)
+
+	def __len__(self):
+		return self.count
+
+	def add(self, x, y, direction=1):
+		if self.count == len(self.x):
+			for name in ("x", "y", "direction"):
+				setattr(self, name, np.concatenate([getattr(self, name), np.zeros(len(self.x))]))
+		self.x[self.count], self.y[self.count], self.direction[self.count] = x, y, direction
+		self.count += 1
+
+	#Drops every projectile where keep is False, the rest stay in order
+	def keep(self, keep):
+		count = int(np.count_nonzero(keep))
+		if count < self.count:
+			for array in (self.x, self.y, self.direction):
+				array[:count] = array[:self.count][keep]
+			self.count = count
+
+	#Moves every projectile and removes the ones that left the screen
 	def move(self):
-		self.x += self.speed*self.direction
-
-		if self.x <= -40 or self.x >= windowWidth + 40:
-			self.erase()
-
-	#Removes projectile
-	def erase(self):
-		self.game.erase_projectile(self)
+		x = self.x[:self.count]
+		x += self.speed * self.direction[:self.count]
+		self.keep((x > -40) & (x < windowWidth + 40))
+
+	def rects(self):
+		count = self.count
+		return np.stack([self.x[:count], self.y[:count], np.full(count, self.projectileWidth + 3.0), np.full(count, self.projectileHeight + 3.0)], axis=1)
+
+	#(projectile, ball) index pairs whose rects collide, sorted by projectile.
+	#Small batches are tested pair by pair, larger ones in one pass on arrays
+	def hits(self, ball_rects):
+		if self.count * len(ball_rects) < VECTOR_PAIRS:
+			width, height = self.projectileWidth + 3, self.projectileHeight + 3
+			projectiles = [(x, y, width, height) for x, y in zip(self.x[:self.count].tolist(), self.y[:self.count].tolist())]
+			return [(i, j) for i, rect in enumerate(projectiles) for j, ball in enumerate(ball_rects) if self.game.check_collisions(rect, ball)]
+		return np.argwhere(rects_collide(self.rects()[:, None, :], np.asarray(ball_rects, dtype=float)[None, :, :])).tolist()
 
 	def draw(self):
-		pygame.gfxdraw.box(window, (int(self.x), int(self.y), self.projectileWidth, self.projectileHeight), (240, 126, 65))
-
-	def rect(self):
-		return (self.x, self.y, self.projectileWidth + 3, self.projectileHeight + 3)
+		rects = []
+		for x, y in zip(self.x[:self.count].tolist(), self.y[:self.count].tolist()):
+			rect = (int(x), int(y), self.projectileWidth, self.projectileHeight)
+			pygame.gfxdraw.box(self.game.window, rect, (240, 126, 65))
+			rects.append(rect)
+		return rects
 
 
 class Game:
-	def __init__(self):
+	#Headless games (window=None) run the game logic only, with no drawing or clock.
+	#dirty redraws only the regions sprites moved through instead of the whole screen.
+	#integrator is a name from integrators.INTEGRATORS or an integrator.
+	#profile starts the frame profiler, F3 toggles its overlay and F4 exports it
+	#to profile.csv, which needs profile or the overlay on to have recorded
+	#anything. seed makes the game reproducible, a random one is picked when None
+	def __init__(self, window=None, dirty=False, integrator="rk4", profile=False, seed=None):
+		self.window = window
+		self.profiler = Profiler(profile)
+		if seed is None:
+			seed = random.SystemRandom().randrange(1 << 32)
+		self.seed = seed
+		self.random = random.Random(seed)
+		#Set to a replay.Recorder to record the keys held every frame
+		self.recorder = None
+		self.integrator = integrators.get(integrator)
+		self.integrators = {}
+		self.headless = window is None
+		self.frame = 0
+		self.renderer = None
+		if dirty and not self.headless:
+			self.renderer = DirtyRenderer(window, None)
+		#Background and boundaries, built on the first draw
+		self.static_layer = None
+		#Physics steps per second, and frames drawn per second by run()
 		self.FPS = 100
+		self.render_FPS = 60
 		self.player_1_score = 0
 		self.player_2_score = 0
 		self.score_to_win = 5
 		self.paddle1 = Paddle(self, 1)
 		self.paddle2 = Paddle(self, 2)
-		ball_dir = -1 + 2*random.SystemRandom().randint(0, 1)
+		ball_dir = -1 + 2*self.random.randint(0, 1)
 		self.ball_size = 14
-		self.asteroid = pygame.image.load("asteroid.png")
+		self.asteroid = None if self.headless else assets.image("asteroid.png")
 		self.balls = [Ball(self, self.FPS, ball_dir * 7, 3, self.ball_size)]
-		self.projectiles = {}
-		self.projectiles_to_remove = deque()
-		self.font = pygame.font.SysFont("Courier", 64, True)
-		self.projectile_counter = 0
+		self.projectiles = Projectiles(self)
+		self.font = cache.font("Courier", 64, True)
 		self.ball_collision_check = [False, False]
 		self.boundary_width = 5
 		self.b_game_over = False
@@ -269,6 +322,10 @@ class Game:
 		#Number of 'blinks' a boundary undergoes after each collision
 		self.blink_iterations = 8
 		self.boundaries = self.set_boundaries()
+		#Color of each boundary at the current step of its blink
+		self.boundary_colors = [self.bound_color] * len(self.boundaries)
+		#Colors the static layer last drew the boundaries in
+		self.painted_colors = list(self.boundary_colors)
 
 
 	def increment_score(self, player):
@@ -288,15 +345,21 @@ class Game:
 	def reset_balls(self):
 		if self.ball_size < 40:
 			self.ball_size = int(self.ball_size * 1.1)
-		ball_dir = -1 + 2*random.SystemRandom().randint(0, 1)
+		ball_dir = -1 + 2*self.random.randint(0, 1)
 		self.balls = [Ball(self, self.FPS, ball_dir * 8, 3, size=self.ball_size)]
 
 	#Display the score strings
 	def render_score(self):
-		scoreRender1 = self.font.render(str(self.player_1_score), 1, (255, 255, 255))
-		scoreRender2 = self.font.render(str(self.player_2_score), 1, (255, 255, 255))
-		window.blit(scoreRender1, (windowWidth // 4, windowHeight // 16))
-		window.blit(scoreRender2, ((3*windowWidth) // 4, windowHeight // 16))
+		scoreRender1 = cache.render(self.font, str(self.player_1_score), (255, 255, 255))
+		scoreRender2 = cache.render(self.font, str(self.player_2_score), (255, 255, 255))
+		rect1 = self.window.blit(scoreRender1, (windowWidth // 4, windowHeight // 16))
+		rect2 = self.window.blit(scoreRender2, ((3*windowWidth) // 4, windowHeight // 16))
+		return [rect1, rect2]
+
+	#Milliseconds of game time, counted in frames so that recorded games and
+	#headless runs see the same firing delays as a live game
+	def get_ticks(self):
+		return self.frame * 1000 // self.FPS
 
 	#Collision detection - compares boundaries of two rectangles
 	def check_collisions(self, rect1, rect2, already_collided = False):
@@ -309,13 +372,7 @@ class Game:
 
 	#Create a new projectile
 	def generate_projectile(self, x, y, direction):
-		projectile = Projectile(self, x, y, self.projectile_counter, direction)
-		self.projectiles[self.projectile_counter] = projectile
-		self.projectile_counter += 1
-
-	#Erase a projectile
-	def erase_projectile(self, projectile):
-		self.projectiles_to_remove.append(projectile.value)
+		self.projectiles.add(x, y, direction)
 
 	#Sets the top, bottom, upper left, lower left, upper right, and lower right boundaries as rectangles
 	#Returns array
@@ -330,6 +387,26 @@ class Game:
 
 		return [top_boundary, bot_boundary, left_boundary_top, left_boundary_bot, right_boundary_top, right_boundary_bot]
 
+	#Advances every ball by one frame, together on state arrays for each integrator
+	def move_balls(self, balls):
+		groups = {}
+		for ball in balls:
+			groups.setdefault(integrators.for_body(ball, self.integrator, self.integrators), []).append(ball)
+		for integrator, group in groups.items():
+			x = np.array([ball.x for ball in group], dtype=float)
+			y = np.array([ball.y for ball in group], dtype=float)
+			xSpeed = np.array([ball.xSpeed for ball in group], dtype=float)
+			ySpeed = np.array([ball.ySpeed for ball in group], dtype=float)
+			g = np.array([ball.g for ball in group], dtype=float)
+			accel = lambda x, y, active=slice(None): calc_accel(x, y, g[active])
+			delta_x, delta_y, delta_vx, delta_vy = integrator(accel, x, y, xSpeed, ySpeed, [id(ball) for ball in group])
+			for i, ball in enumerate(group):
+				ball.prev_position = (ball.x, ball.y)
+				ball.x = float(x[i] + delta_x[i])
+				ball.y = float(y[i] + delta_y[i])
+				ball.xSpeed = float(xSpeed[i] + delta_vx[i])
+				ball.ySpeed = float(ySpeed[i] + delta_vy[i])
+
 	#Remove a ball from the screen
 	def remove_ball(self, ball):
 		self.balls.remove(ball)
@@ -343,17 +420,59 @@ class Game:
 		else:
 			self.remove_ball(ball)
 			if len(self.balls) <= 0:
-				self.font = pygame.font.SysFont("Courier", 48, True)
+				self.font = cache.font("Courier", 48, True)
 
 				win_string = "Congratulations! Both players win!"
 				self.win_string = win_string
 				self.b_game_over = True
 
 
+	#Catches a ball that crossed rect's side facing axis (0 for x, 1 for y)
+	#during the frame, which fast balls do without overlapping rect at the end
+	#or with their centre already past it. moved is how far rect itself moved
+	#this frame. The ball is put back as if it had bounced at the moment of
+	#impact. Returns whether it hit
+	def swept_collision(self, ball, rect, axis, moved=(0, 0)):
+		start_x, start_y = ball.prev_position
+		dx, dy = ball.x - start_x - moved[0], ball.y - start_y - moved[1]
+		if dx == 0 and dy == 0:
+			return False
+		#Cheap rejection: the boxes covering the whole move of each miss
+		size, mx, my = ball.size, abs(moved[0]), abs(moved[1])
+		if min(start_x, ball.x) - size > rect[0] + rect[2] + mx or max(start_x, ball.x) + size < rect[0] - mx or min(start_y, ball.y) - size > rect[1] + rect[3] + my or max(start_y, ball.y) + size < rect[1] - my:
+			return False
+		start = (start_x - ball.size, start_y - ball.size, ball.size * 2, ball.size * 2)
+		target = (rect[0] - moved[0], rect[1] - moved[1], rect[2], rect[3])
+		#Already touching, the overlap test handles it
+		if self.check_collisions(start, target) or self.check_collisions(target, start):
+			return False
+		if self.check_collisions(ball.rect(), rect) or self.check_collisions(rect, ball.rect()):
+			#Ending up overlapping is only a problem once the centre is past the side
+			centre, delta, near, far = (ball.x, dx, rect[0], rect[0] + rect[2]) if axis == 0 else (ball.y, dy, rect[1], rect[1] + rect[3])
+			if not (delta < 0 and centre < far or delta > 0 and centre > near):
+				return False
+		hit = sweep(start, dx, dy, target)
+		if hit is None or hit[0] <= 0:
+			return False
+		time, side = hit
+		if side == axis == 0:
+			ball.x = start_x + (2 * time - 1) * dx + moved[0]
+		elif side == axis == 1:
+			ball.y = start_y + (2 * time - 1) * dy + moved[1]
+		return True
+
+	#Whether the ball stayed between the paddles and the top and bottom
+	#boundaries for the whole frame, so it cannot have hit anything
+	def in_open_field(self, ball):
+		start_x, start_y = ball.prev_position
+		top, bottom = self.boundaries[0], self.boundaries[1]
+		paddle = self.paddle1.rect()
+		return min(start_x, ball.x) - ball.size > paddle[0] + paddle[2] and max(start_x, ball.x) + ball.size < self.paddle2.x and min(start_y, ball.y) - ball.size > top[1] + top[3] and max(start_y, ball.y) + ball.size < bottom[1]
+
 	#Checks for collision with boundaries
-	def boundary_collision_check(self, ball):
+	def boundary_collision_check(self, ball, swept=True):
 		for each in range(len(self.boundaries)):
-			collision = self.check_collisions(ball.rect(), self.boundaries[each])
+			collision = (swept and self.swept_collision(ball, self.boundaries[each], 1 if each < 2 else 0)) or self.check_collisions(ball.rect(), self.boundaries[each])
 			if collision and not ball.ball_boundary_collision_check[each]:
 				ball.ball_boundary_collision_check[each] = True
 				self.boundary_hit(each)
@@ -368,9 +487,9 @@ class Game:
 				ball.ball_boundary_collision_check[each] = False
 
 
-	#Draws all the boundaries
-	def draw_boundaries(self, boundaries):
-		for i in range(len(boundaries)):
+	#Advances the boundaries' blink animations by one step
+	def blink_boundaries(self):
+		for i in range(len(self.boundaries)):
 			if self.bound_hit[i] == 1:
 				color = self.boundary_blink(self.aBoundIndex[i])
 				self.aBoundIndex[i] += 1
@@ -379,8 +498,20 @@ class Game:
 			if self.aBoundIndex[i] >= self.blink_iterations * 2:
 				self.bound_hit[i] = 0
 				self.aBoundIndex[i] = 0
+			self.boundary_colors[i] = color
+
+	#Repaints the boundaries whose color changed since the static layer last drew them
+	def repaint_boundaries(self):
+		for i, color in enumerate(self.boundary_colors):
+			if color != self.painted_colors[i]:
+				self.painted_colors[i] = color
+				self.static_layer.invalidate(self.boundaries[i])
 
-			pygame.gfxdraw.box(window, boundaries[i], color)
+	#Draws the background and boundaries onto the static layer, clipped to area
+	def draw_boundaries(self, surface, area):
+		surface.fill((20, 20, 20), area)
+		for boundary, color in zip(self.boundaries, self.painted_colors):
+			pygame.gfxdraw.box(surface, boundary, color)
 
 	#Determines color of blink animation
 	def boundary_blink(self, index):
@@ -399,11 +530,150 @@ class Game:
 		self.bound_hit[i_boundary] = 1
 		self.aBoundIndex[i_boundary] = 0
 		
-	#Game loop
+	#Advances paddles, balls and projectiles by one frame, draws nothing
+	def step(self, keys):
+		if self.recorder is not None:
+			self.recorder.keys(self.frame, replay.encode_keys(keys, PADDLE_KEYS))
+		self.physics(keys)
+		self.profiler.lap("physics")
+		self.collisions()
+		self.blink_boundaries()
+		self.profiler.lap("collisions")
+		self.frame += 1
+
+	def physics(self, keys):
+		self.paddle1.action(keys)
+		self.paddle2.action(keys)
+		self.move_balls(list(self.balls))
+		self.projectiles.move()
+
+	def collisions(self):
+		balls = list(self.balls)
+		for ball in self.balls:
+			swept = not self.in_open_field(ball)
+			self.boundary_collision_check(ball, swept)
+			
+			#Check collisions of balls with the paddles
+			if (swept and not self.ball_collision_check[0] and self.swept_collision(ball, self.paddle1.rect(), 0, (0, self.paddle1.y - self.paddle1.prev_y))) or self.check_collisions(ball.rect(), self.paddle1.rect(), self.ball_collision_check[0]) or self.check_collisions(self.paddle1.rect(), ball.rect(), self.ball_collision_check[0]):
+				self.ball_collision_check[0] = True
+				ball.set_direction_x(1)
+				self.paddle1.onCollision()
+			else:
+				self.ball_collision_check[0] = False
+
+			if (swept and not self.ball_collision_check[1] and self.swept_collision(ball, self.paddle2.rect(), 0, (0, self.paddle2.y - self.paddle2.prev_y))) or self.check_collisions(ball.rect(), self.paddle2.rect(), self.ball_collision_check[1]) or self.check_collisions(self.paddle2.rect(), ball.rect(), self.ball_collision_check[1]):
+				self.ball_collision_check[1] = True
+				ball.set_direction_x(-1)
+				self.paddle2.onCollision()
+			else:
+				self.ball_collision_check[1] = False
+
+		#Only projectiles touching a ball at the start of the loop are checked
+		#one by one. Splits only shrink or remove balls, so none are missed
+		hits = self.projectiles.hits([ball.rect() for ball in self.balls])
+		if len(hits) > 0:
+			self.projectile_collisions(hits)
+
+		#Scored only after the sweeps, so a fast ball that crossed a paddle
+		#during the frame bounces instead of counting as past it
+		for ball in balls:
+			ball.check_score()
+
+	def projectile_collisions(self, hits):
+		new_balls = []
+		removed = np.zeros(len(self.projectiles), dtype=bool)
+		rects = self.projectiles.rects().tolist()
+		directions = self.projectiles.direction.tolist()
+		for each in sorted(set(i for i, j in hits)):
+			rect = rects[each]
+			for ball in self.balls:
+				if (self.check_collisions(ball.rect(), rect) or self.check_collisions(rect, ball.rect())) and not removed[each]:
+					removed[each] = True
+					new_ball = self.ball_split(ball)
+					if new_ball:
+						new_balls.append(new_ball)
+					ball.on_projectile_collision(directions[each])
+		for each in new_balls:
+			self.balls.append(each)
+
+		#Remove projectiles that have collided with a ball
+		self.projectiles.keep(~removed)
+
+	#Where balls, paddles and projectiles are drawn, alpha of the way from the
+	#state before the last step to the state after it
+	def drawn_positions(self, alpha):
+		if alpha >= 1:
+			return []
+		changes = []
+		for ball in self.balls:
+			x, y = ball.prev_position
+			changes += [(ball, "x", x + alpha * (ball.x - x)), (ball, "y", y + alpha * (ball.y - y))]
+		for paddle in (self.paddle1, self.paddle2):
+			changes.append((paddle, "y", int(round(paddle.prev_y + alpha * (paddle.y - paddle.prev_y)))))
+		projectiles = self.projectiles
+		changes.append((projectiles, "x", projectiles.x - (1 - alpha) * projectiles.speed * projectiles.direction))
+		return changes
+
+	def draw(self, alpha=1.0):
+		if self.static_layer is None:
+			self.static_layer = StaticLayer(self.window.get_size(), self.draw_boundaries)
+		self.repaint_boundaries()
+		self.static_layer.draw(self.window, self.renderer)
+		rects = self.render_score()
+		self.profiler.lap("background")
+		with swapped(self.drawn_positions(alpha)):
+			rects += self.projectiles.draw()
+			for each in self.balls:
+				rects.append(each.draw())
+			rects.append(self.paddle1.draw())
+			rects.append(self.paddle2.draw())
+		self.profiler.lap("sprites")
+		rects.append(self.profiler.draw(self.window))
+		if self.renderer is not None:
+			for rect in rects:
+				self.renderer.mark(rect)
+
+	#Runs a headless game as fast as possible until someone wins or max_frames
+	#pass. keys maps a frame number to the keys held down on that frame
+	def simulate(self, max_frames, keys=None):
+		keys = keys or {}
+		while self.frame < max_frames and not self.b_game_over:
+			self.step(KeyState(keys.get(self.frame, ())))
+		return self.player_1_score, self.player_2_score
+
+	#Plays back a recorded game from the same seed. Runs uncapped unless
+	#realtime, which steps at the game's rate and draws at render_FPS. Returns the scores
+	def play(self, log, realtime=False):
+		changes = log.keys()
+		keys = KeyState()
+		clock = pygame.time.Clock()
+		timer = FixedStep(self.FPS)
+		realtime = realtime and not self.headless
+		length = log.frames(REPLAY_NAME)
+		while self.frame < length and not self.b_game_over:
+			for i in range(timer.advance() if realtime else 1):
+				if self.frame >= length or self.b_game_over:
+					break
+				if self.frame in changes:
+					keys = KeyState(replay.decode_keys(changes[self.frame], PADDLE_KEYS))
+				self.step(keys)
+			if realtime:
+				for event in pygame.event.get():
+					if event.type == pygame.QUIT:
+						return self.player_1_score, self.player_2_score
+				self.draw(timer.alpha())
+				present(self.renderer)
+				clock.tick(self.render_FPS)
+		return self.player_1_score, self.player_2_score
+
+	#Game loop. Physics steps at FPS whatever the frame rate, a slow frame is
+	#caught up with extra steps before drawing
 	def run(self):
 		clock = pygame.time.Clock()
+		timer = FixedStep(self.FPS)
 		paused = False
 		while not self.b_game_over:
+			self.profiler.start()
 			keys = pygame.key.get_pressed()
 			#Exit game with ESC or U
 			if keys[pygame.K_ESCAPE]:
@@ -418,64 +688,27 @@ class Game:
 							paused = True
 						else:
 							paused = False
+					if event.key == pygame.K_F3:
+						self.profiler.toggle_overlay()
+					if event.key == pygame.K_F4:
+						self.profiler.export("profile.csv")
 				if event.type == pygame.QUIT:
 					exit()
-			#Set bg color
-			window.fill((20, 20, 20))
-			boundaries = self.set_boundaries()
-			self.draw_boundaries(boundaries)
-			if not paused:
-				self.paddle1.action()
-				self.paddle2.action()
-				for ball in self.balls:
-					ball.move()
-					self.boundary_collision_check(ball)
-					
-					#Check collisions of balls with the paddles
-					if self.check_collisions(ball.rect(), self.paddle1.rect(), self.ball_collision_check[0]) or self.check_collisions(self.paddle1.rect(), ball.rect(), self.ball_collision_check[0]):
-						self.ball_collision_check[0] = True
-						ball.set_direction_x(1)
-						self.paddle1.onCollision()
-					else:
-						self.ball_collision_check[0] = False
-
-					if self.check_collisions(ball.rect(), self.paddle2.rect(), self.ball_collision_check[1]) or self.check_collisions(self.paddle2.rect(), ball.rect(), self.ball_collision_check[1]):
-						self.ball_collision_check[1] = True
-						ball.set_direction_x(-1)
-						self.paddle2.onCollision()
-					else:
-						self.ball_collision_check[1] = False
-			
-			self.render_score()
-			
-			new_balls = []
-			for each in self.projectiles:
-				projectile = self.projectiles[each]
-				projectile.move()
-				if not paused:
-					projectile.draw()
-					#Check collision of projectile with the balls
-					for ball in self.balls:
-						if (self.check_collisions(ball.rect(), projectile.rect()) or self.check_collisions(projectile.rect(), ball.rect())) and each not in self.projectiles_to_remove:
-							projectile.erase()
-							new_ball = self.ball_split(ball)
-							if new_ball:
-								new_balls.append(new_ball)
-							ball.on_projectile_collision(projectile.direction)
-			for each in new_balls:
-				self.balls.append(each)
-
-			#Remove projectiles that have collided with a ball
-			for each in self.projectiles_to_remove:
-				del self.projectiles[each]
-
-			self.projectiles_to_remove.clear()
-			for each in self.balls:
-				each.draw()
-			self.paddle1.draw()
-			self.paddle2.draw()
-			pygame.display.flip()
-			clock.tick(self.FPS)
+			self.profiler.lap("input")
+			steps = timer.advance()
+			if paused:
+				steps = 0
+			for i in range(steps):
+				self.step(keys)
+				if self.b_game_over:
+					break
+			self.draw(timer.alpha() if not paused else 1.0)
+			self.profiler.lap("hud")
+			present(self.renderer)
+			self.profiler.lap("present")
+			clock.tick(self.render_FPS)
+			self.profiler.lap("wait")
+			self.profiler.end(balls=len(self.balls), projectiles=len(self.projectiles), steps=steps)
 		curr_time = pygame.time.get_ticks()
 
 		while self.b_game_over:
@@ -490,27 +723,50 @@ class Game:
 					exit()
 
 			#Game over screen
-			window.fill((255, 255, 255))
+			self.window.fill((255, 255, 255))
 			win_str_size = self.font.size(self.win_string)
-			renderWin = self.font.render(self.win_string, 1, (0, 0, 0))
-			window.blit(renderWin, (windowWidth // 2 - win_str_size[0] // 2, windowHeight // 2 - win_str_size[1] // 2))
+			renderWin = cache.render(self.font, self.win_string, (0, 0, 0))
+			self.window.blit(renderWin, (windowWidth // 2 - win_str_size[0] // 2, windowHeight // 2 - win_str_size[1] // 2))
 
 			#Reset game
 			if pygame.time.get_ticks() - curr_time > 1000:
 				retry_str = "Press SPACE to play again."
-				retry_font = pygame.font.SysFont("Courier", 32, True)
+				retry_font = cache.font("Courier", 32, True)
 				retry_size = retry_font.size(retry_str)
-				render_retry = retry_font.render(retry_str, 1, (0,0,0))
-				window.blit(render_retry, (windowWidth // 2 - retry_size[0] // 2, windowHeight // 2 + retry_size[1] // 2))
+				render_retry = cache.render(retry_font, retry_str, (0,0,0))
+				self.window.blit(render_retry, (windowWidth // 2 - retry_size[0] // 2, windowHeight // 2 + retry_size[1] // 2))
 
 				if keys[pygame.K_SPACE]:
 					self.b_game_over = False
 			pygame.display.flip()
 			clock.tick(self.FPS)
-		main()
+
+#Plays a recording made with --record, headless and uncapped unless --realtime
+def play_replay(path):
+	game, scores, seconds = replay.play_file(path, lambda window, seed: Game(window, seed=seed), "--realtime" in sys.argv, (windowWidth, windowHeight), "Gravity Pong replay")
+	print("Score %d - %d after %d frames (%.2fs)" % (scores[0], scores[1], game.frame, seconds))
 
 def main():
-	game = Game()
-	game.run()
-main()
+	if replay.option(sys.argv, "--replay") is not None:
+		play_replay(replay.option(sys.argv, "--replay"))
+		return
+	record = replay.option(sys.argv, "--record")
+	window = pygame.display.set_mode((windowWidth, windowHeight), pygame.FULLSCREEN)
+	pygame.display.set_caption("Gravity Pong")
+	round_number = 0
+	while True:
+		round_number += 1
+		game = Game(window, dirty="--dirty" in sys.argv, profile="--profile" in sys.argv)
+		if replay.option(sys.argv, "--render-fps") is not None:
+			game.render_FPS = int(replay.option(sys.argv, "--render-fps"))
+		if record is not None:
+			game.recorder = replay.Recorder(replay.round_path(record, round_number), REPLAY_NAME, game.seed, game.FPS)
+		try:
+			game.run()
+		finally:
+			if game.recorder is not None:
+				game.recorder.close(game.frame)
+
+if __name__ == "__main__":
+	main()
 